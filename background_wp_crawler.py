@@ -8,26 +8,39 @@ import asyncio
 import csv
 import os
 import random
-import re
 import ssl
 import sys
 import time
-import urllib.parse
+from collections import defaultdict
 from pathlib import Path
+from urllib.parse import quote_plus, urlsplit
 
 import aiohttp
-from bs4 import BeautifulSoup
+
+from patterns import (HEAD_UNRELIABLE, WP_BYTES_REGEX, bing_result_links, endpoint_hit,
+                      is_wp_endpoint)
+from search_cache import SearchCache
 
 # Configuration
 NAMES_CSV = "acuity_idns.csv"
 OUTPUT_CSV = "wordpress_idns.csv"
 PROGRESS_LOG = "crawler_progress.log"
-SEARCH_DELAY = 10.0  # Conservative delay between searches
-FETCH_DELAY = 3.0   # Delay between website fetches
-MAX_CONCURRENT = 1  # Sequential processing to avoid rate limiting
+SEARCH_CACHE_DB = "bing_cache.sqlite"
+SEARCH_CACHE_TTL = 7 * 86400  # Re-search a name after a week
+SEARCH_DELAY = 10.0  # Starting delay between searches, adapted to Bing's responses
+BING_MIN_DELAY = 0.5  # Floor the search delay decays towards while Bing answers 200
+BING_HOST = "www.bing.com"
+BING_MAX_DELAY = 60.0  # Ceiling for the delay while Bing keeps throttling
+FETCH_DELAY = 3.0   # Minimum delay between fetches to the same host
+CONCURRENCY = 16  # Number of IDN workers pulling from the queue
+MAX_PER_HOST = 1  # In-flight requests allowed per target host
 MAX_BING_RESULTS = 2  # Fewer results to reduce load
 TIMEOUT = 60  # Longer timeout
 MAX_RETRIES = 3
+MAX_HOST_TIMEOUTS = 3  # Give up on a host after this many consecutive timeouts
+SCAN_CHUNK = 8192  # Bytes read per chunk when scanning a page
+SCAN_OVERLAP = 64  # Bytes re-scanned so a match can't straddle two chunks
+MAX_SCAN_BYTES = 65536  # Fingerprints live in <head>; stop reading after this
 
 # Sub-domain prefixes to test for WordPress
 WP_PREFIXES = ["", "www.", "blog.", "news.", "media.", "press."]
@@ -35,31 +48,62 @@ WP_PREFIXES = ["", "www.", "blog.", "news.", "media.", "press."]
 # Paths to test for WordPress
 WP_PATHS = ["/", "/blog", "/news", "/wp-json/wp/v2", "/wp-login.php", "/wp-admin", "/xmlrpc.php"]
 
-# Enhanced WordPress detection patterns
-WP_PATTERNS = [
-    r'wp-content[/\\]',
-    r'wp-includes[/\\]',
-    r'wp-admin[/\\]',
-    r'/wp-json/',
-    r'wordpress',
-    r'wp_version',
-    r'generator.*wordpress',
-    r'wp-embed',
-    r'wp_enqueue_script',
-    r'wpdb',
-    r'wp_head\(\)',
-    r'wp_footer\(\)'
-]
-
-WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
+# Statuses that mean the path really isn't there; any other failure is
+# treated as temporary and never cached as a miss
+DEAD_STATUSES = (404, 410)
+
+class HostLimiter:
+    """Space out requests to the same host while letting different hosts run concurrently."""
+
+    def __init__(self, rps):
+        self._interval = 1 / rps
+        self._last = {}
+        self._locks = defaultdict(asyncio.Lock)
+
+    async def acquire(self, host, interval=None):
+        """Wait until at least 1/rps seconds (or interval, if given) have passed
+        since the last request to host."""
+        if interval is None:
+            interval = self._interval
+        async with self._locks[host]:
+            loop = asyncio.get_running_loop()
+            if host in self._last:
+                await asyncio.sleep(max(0, self._last[host] + interval - loop.time()))
+            self._last[host] = loop.time()
+
+# Politeness is enforced per target host rather than by serialising the crawl
+HOST_SEMAPHORES = defaultdict(lambda: asyncio.Semaphore(MAX_PER_HOST))
+HOST_LIMITER = HostLimiter(1 / FETCH_DELAY)
+
+# Built once at import and shared by every connector, so the system root
+# store is only loaded once per process
+SSL_CTX = ssl.create_default_context()
+
+# Current delay between Bing searches, see adjust_bing_delay()
+bing_delay = SEARCH_DELAY
+
+# Log lines are queued here and written by log_writer(), so workers never
+# block the event loop on file I/O
+_log_queue = asyncio.Queue()
 
 def log_progress(message):
     """Log progress to both console and file."""
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     log_msg = f"[{timestamp}] {message}"
     print(log_msg, flush=True)
-    with open(PROGRESS_LOG, "a", encoding="utf-8") as f:
-        f.write(log_msg + "\n")
+    _log_queue.put_nowait(log_msg + "\n")
+
+async def log_writer():
+    """Own the progress log and append queued lines until a None sentinel arrives."""
+    with open(PROGRESS_LOG, "w", encoding="utf-8") as f:
+        while True:
+            lines = [await _log_queue.get()]
+            while not _log_queue.empty():
+                lines.append(_log_queue.get_nowait())
+            f.writelines(line for line in lines if line is not None)
+            f.flush()
+            if None in lines:
+                return
 
 def load_idn_names():
     """Load IDN names from CSV file."""
@@ -78,93 +122,181 @@ def load_idn_names():
     log_progress(f"Loaded {len(names)} IDN names")
     return names
 
-def write_wordpress_result(name, domain):
-    """Write a WordPress result immediately to CSV."""
-    file_exists = os.path.exists(OUTPUT_CSV)
-    
-    with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(['name', 'domain'])
-        writer.writerow([name, domain])
-    
+def write_wordpress_result(writer, name, domain):
+    """Write a WordPress result immediately to the open results CSV."""
+    writer.writerow([name, domain])
     log_progress(f"✓ WordPress found: {name} -> {domain}")
 
+def adjust_bing_delay(status, retry_after=None):
+    """Ease the search delay off after a success; double it when Bing throttles."""
+    global bing_delay
+    if status == 200:
+        bing_delay = max(BING_MIN_DELAY, bing_delay * 0.9)
+    elif status == 429 or status >= 500:
+        bing_delay = min(BING_MAX_DELAY, bing_delay * 2.0)
+        if retry_after and retry_after.isdigit():
+            bing_delay = max(bing_delay, float(retry_after))
+
 async def search_bing(session, query):
-    """Search Bing for domains related to the query."""
+    """Search Bing for domains related to the query.
+
+    Bing is treated like any other host: one request in flight at a time,
+    spaced by the adaptive bing_delay, while other workers keep probing
+    target sites in the meantime.
+
+    Returns None when the search itself failed, so callers can tell a failed
+    request apart from a search that genuinely found nothing.
+    """
     try:
-        search_url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
+        search_url = f"https://{BING_HOST}/search?q={quote_plus(query)}"
         
-        async with session.get(search_url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as response:
-            if response.status != 200:
-                return []
-            
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            domains = []
-            for link in soup.select("h2 a, .b_algo h2 a"):
-                href = link.get("href")
-                if href and isinstance(href, str) and href.startswith("http"):
-                    try:
-                        parsed = urllib.parse.urlparse(href)
-                        if parsed.netloc and parsed.netloc not in domains:
-                            domains.append(parsed.netloc)
-                            if len(domains) >= MAX_BING_RESULTS:
-                                break
-                    except:
-                        continue
-            
-            return domains
+        async with HOST_SEMAPHORES[BING_HOST]:
+            await HOST_LIMITER.acquire(BING_HOST, bing_delay + random.random() * 0.2 * bing_delay)
+            async with session.get(search_url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as response:
+                adjust_bing_delay(response.status, response.headers.get("Retry-After"))
+                if response.status != 200:
+                    return None
+                
+                body = await response.read()
+        
+        domains = []
+        for href in bing_result_links(body):
+            try:
+                parsed = urlsplit(href)
+                if parsed.netloc and parsed.netloc not in domains:
+                    domains.append(parsed.netloc)
+                    if len(domains) >= MAX_BING_RESULTS:
+                        break
+            except:
+                continue
+        
+        return domains
             
     except Exception as e:
         log_progress(f"Bing search error for '{query}': {e}")
-        return []
+        return None
+
+async def scan_for_wordpress(response):
+    """Stream the body and stop as soon as a WordPress fingerprint shows up."""
+    buf = bytearray()
+    async for chunk in response.content.iter_chunked(SCAN_CHUNK):
+        start = max(0, len(buf) - SCAN_OVERLAP)
+        buf.extend(chunk)
+        if WP_BYTES_REGEX.search(buf, start):
+            return True
+        if len(buf) >= MAX_SCAN_BYTES:
+            break
+    return False
 
 async def test_wordpress(session, url):
-    """Test if a URL runs WordPress."""
+    """Test if a URL runs WordPress.
+
+    Returns True or False only for a real verdict, which probe_host caches.
+    Network errors and statuses that may be temporary (403, 429, 5xx...)
+    return None, so the URL is tried again on a later run.
+    """
+    parts = urlsplit(url)
+    host = parts.netloc
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as response:
-            if response.status == 200:
-                html = await response.text()
-                return bool(WP_REGEX.search(html))
-    except:
-        pass
+        async with HOST_SEMAPHORES[host]:
+            await HOST_LIMITER.acquire(host)
+            # Cheap HEAD first so dead paths never download a body;
+            # endpoints are judged on their own answer, without redirects
+            is_endpoint = is_wp_endpoint(parts.path)
+            status = None
+            try:
+                async with session.head(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT), allow_redirects=not is_endpoint) as response:
+                    if is_endpoint and endpoint_hit(parts.path, response.status, response.content_type):
+                        return True
+                    status = response.status
+            except asyncio.TimeoutError:
+                raise
+            except aiohttp.ClientError:
+                pass  # Some servers choke on HEAD alone; the GET decides
+            if status in DEAD_STATUSES:
+                return False
+            if status is not None and status >= 400 and status not in HEAD_UNRELIABLE:
+                return None
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as response:
+                if response.status == 200:
+                    return await scan_for_wordpress(response)
+                return False if response.status in DEAD_STATUSES else None
+    except asyncio.TimeoutError:
+        raise
+    except Exception:
+        # Not BaseException: a cancelled probe must propagate, not come back
+        # as a verdict that probe_host would cache
+        return None
+
+async def probe_host(session, cache, host, paths):
+    """Probe a host's paths in order and return True on the first WordPress hit."""
+    timeouts = 0
+    for path in paths:
+        if timeouts >= MAX_HOST_TIMEOUTS:
+            return False
+        url = f"https://{host}{path}"
+        found = cache.get_probe(url)
+        if found is None:
+            try:
+                found = await test_wordpress(session, url)
+            except asyncio.TimeoutError:
+                timeouts += 1
+                continue
+            timeouts = 0
+            if found is None:
+                continue
+            cache.put_probe(url, found)
+        if found:
+            return True
     return False
 
-async def check_idn_for_wordpress(session, name):
+async def check_idn_for_wordpress(session, cache, name):
     """Check if an IDN uses WordPress by searching and testing domains."""
     try:
-        # Search for domains related to this IDN
-        domains = await search_bing(session, name)
-        await asyncio.sleep(SEARCH_DELAY + random.uniform(0, 2))
+        # Search for domains related to this IDN, unless searched recently.
+        # Empty result lists are cached too; only failed searches are retried.
+        domains = cache.get(name)
+        if domains is None:
+            domains = await search_bing(session, name)
+            if domains is not None:
+                cache.put(name, domains)
         
         if not domains:
             return None
         
-        # Test each domain with various prefixes and paths
+        # Every prefix of every result is a distinct host. Hosts are normalised
+        # so www.example.com and example.com from the same result set don't
+        # yield duplicate probes, and are probed concurrently; each host still
+        # sees its paths one at a time, conclusive WordPress endpoints first.
+        hosts = {}
         for domain in domains:
+            base = domain.lower().removeprefix('www.')
             for prefix in WP_PREFIXES:
-                for path in WP_PATHS:
-                    test_url = f"https://{prefix}{domain}{path}"
-                    
-                    if await test_wordpress(session, test_url):
-                        return domain
-                    
-                    await asyncio.sleep(FETCH_DELAY)
+                hosts.setdefault(f"{prefix}{base}", domain)
+        paths = sorted(WP_PATHS, key=lambda p: not is_wp_endpoint(p))
         
-        return None
+        tasks = {asyncio.create_task(probe_host(session, cache, host, paths)): domain
+                 for host, domain in hosts.items()}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return tasks[task]
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            # Wait for the cancellations to land so no probe outlives this IDN
+            await asyncio.gather(*pending, return_exceptions=True)
         
     except Exception as e:
         log_progress(f"Error checking {name}: {e}")
         return None
 
-async def main():
-    """Main crawler function."""
-    # Initialize progress log
-    with open(PROGRESS_LOG, "w", encoding="utf-8") as f:
-        f.write("")
-    
+async def crawl():
+    """Load the IDN names and run them through the worker pool."""
     log_progress("Starting WordPress detection crawler...")
     
     # Load IDN names
@@ -181,13 +313,16 @@ async def main():
     
     log_progress(f"Processing {len(names)} IDNs...")
     
-    # Create HTTP session with conservative settings
+    # One long-lived session for every IDN so keep-alive connections, TLS
+    # sessions and DNS answers are reused across the repeated probes per host
     connector = aiohttp.TCPConnector(
-        ssl=ssl.create_default_context(),
-        limit=MAX_CONCURRENT,
-        limit_per_host=1,
-        ttl_dns_cache=300,
-        use_dns_cache=True
+        ssl=SSL_CTX,
+        limit=100,
+        limit_per_host=4,
+        ttl_dns_cache=600,
+        use_dns_cache=True,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True
     )
     
     headers = {
@@ -195,27 +330,57 @@ async def main():
     }
     
     wordpress_count = 0
+    processed = 0
     start_time = time.time()
     
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
-        for i, name in enumerate(names, 1):
-            domain = await check_idn_for_wordpress(session, name)
+    queue = asyncio.Queue()
+    for name in names:
+        queue.put_nowait(name)
+    
+    # Keep the results file open for the whole crawl; line buffering pushes
+    # each row to disk as soon as it is written
+    with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8', buffering=1) as out_fh, \
+         SearchCache(SEARCH_CACHE_DB, SEARCH_CACHE_TTL) as cache:
+        writer = csv.writer(out_fh)
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
             
-            if domain:
-                write_wordpress_result(name, domain)
-                wordpress_count += 1
+            async def worker():
+                nonlocal wordpress_count, processed
+                while True:
+                    try:
+                        name = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    
+                    domain = await check_idn_for_wordpress(session, cache, name)
+                    
+                    if domain:
+                        write_wordpress_result(writer, name, domain)
+                        wordpress_count += 1
+                    
+                    # Progress updates every 50 IDNs
+                    processed += 1
+                    if processed % 50 == 0:
+                        elapsed = time.time() - start_time
+                        rate = processed / elapsed * 60  # IDNs per minute
+                        eta_mins = (len(names) - processed) / rate if rate > 0 else 0
+                        log_progress(f"Processed {processed}/{len(names)} IDNs - WordPress found: {wordpress_count} - Rate: {rate:.1f}/min - ETA: {eta_mins:.0f}min")
             
-            # Progress updates every 50 IDNs
-            if i % 50 == 0:
-                elapsed = time.time() - start_time
-                rate = i / elapsed * 60  # IDNs per minute
-                eta_mins = (len(names) - i) / rate if rate > 0 else 0
-                log_progress(f"Processed {i}/{len(names)} IDNs - WordPress found: {wordpress_count} - Rate: {rate:.1f}/min - ETA: {eta_mins:.0f}min")
+            await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
     
     # Final summary
     elapsed = time.time() - start_time
     log_progress(f"COMPLETED: Found {wordpress_count} WordPress sites out of {len(names)} IDNs in {elapsed/3600:.1f} hours")
     log_progress(f"Results saved to {OUTPUT_CSV}")
 
+async def main():
+    """Main crawler function."""
+    log_task = asyncio.create_task(log_writer())
+    try:
+        await crawl()
+    finally:
+        _log_queue.put_nowait(None)
+        await log_task
+
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
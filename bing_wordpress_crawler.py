@@ -8,24 +8,25 @@ Now writes results incrementally to CSV as they are discovered.
 import asyncio
 import csv
 import random
-import re
 import ssl
 import sys
 import time
-import urllib.parse
 from pathlib import Path
+from urllib.parse import quote_plus, urlsplit
 
 import aiohttp
-from bs4 import BeautifulSoup
+
+from patterns import HEAD_UNRELIABLE, WP_REGEX, bing_result_links, endpoint_hit, is_wp_endpoint
 
 # Configuration
 NAMES_CSV = "acuity_idns.csv"
 OUTPUT_CSV = "wordpress_idns.csv"
-SEARCH_DELAY = 5.0  # Much longer delay between Bing requests
+SEARCH_DELAY = 5.0  # Starting delay between Bing requests, adapted to Bing's responses
+BING_MIN_DELAY = 1.0  # Floor the search delay decays towards while Bing answers 200
+BING_MAX_DELAY = 60.0  # Ceiling for the delay while Bing keeps throttling
 CONCURRENCY = 1  # Single worker only
 MAX_BING_RESULTS = 3  # Fewer results per IDN to reduce load
 TIMEOUT = 30  # Longer timeout for requests
-RETRY_DELAY = 10  # Wait longer between retries
 
 # Sub-domain prefixes to test
 WP_PREFIXES = ["blog.", "news.", "today.", "stories.", "newsroom."]
@@ -33,99 +34,98 @@ WP_PREFIXES = ["blog.", "news.", "today.", "stories.", "newsroom."]
 # Paths to test on each domain
 WP_PATHS = ["/", "/blog", "/news", "/wp-json", "/feed", "/rss", "/wp-login.php"]
 
-# WordPress detection patterns
-WP_PATTERNS = [
-    r'wp-content/',
-    r'wp-includes/',
-    r'wordpress',
-    r'<meta name="generator" content="WordPress',
-    r'/wp-json/',
-    r'wp_enqueue_script',
-]
-WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
-
-def write_wordpress_site_to_csv(name: str, domain: str):
-    """Write a WordPress site to CSV immediately when found."""
-    # Check if file exists to determine if we need to write header
-    file_exists = Path(OUTPUT_CSV).exists()
-    
-    with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(['name', 'domain'])
-        writer.writerow([name, f"https://{domain}"])
-    
+# Module-level TLS context, reused instead of rebuilt per connector
+SSL_CTX = ssl.create_default_context()
+
+# Current delay between Bing searches, see adjust_bing_delay()
+bing_delay = SEARCH_DELAY
+
+def write_wordpress_site_to_csv(writer, name: str, domain: str):
+    """Write a WordPress site to the open results CSV immediately when found."""
+    writer.writerow([name, f"https://{domain}"])
     print(f"✓ WordPress found: {name} -> {domain}")
 
+def adjust_bing_delay(status: int | None, retry_after: str | None = None):
+    """Ease the search delay off after a success; double it on throttling or errors."""
+    global bing_delay
+    if status == 200:
+        bing_delay = max(BING_MIN_DELAY, bing_delay * 0.9)
+    elif status is None or status == 429 or status >= 500:
+        bing_delay = min(BING_MAX_DELAY, bing_delay * 2.0)
+        if retry_after and retry_after.isdigit():
+            bing_delay = max(bing_delay, float(retry_after))
+
 async def bing_search(session: aiohttp.ClientSession, name: str) -> list[str]:
     """Search Bing for IDN websites, return hostnames."""
     hosts: list[str] = []
     query = f"{name} official website"
-    url = f"https://www.bing.com/search?q={urllib.parse.quote_plus(query)}"
+    url = f"https://www.bing.com/search?q={quote_plus(query)}"
     
     try:
-        await asyncio.sleep(SEARCH_DELAY + random.random() * 2.0)  # More jitter
+        await asyncio.sleep(bing_delay + random.random() * 0.2 * bing_delay)
         async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
+            adjust_bing_delay(resp.status, resp.headers.get("Retry-After"))
             if resp.status != 200:
                 print(f"Bing search failed for {name}: HTTP {resp.status}")
                 return []
-            html = await resp.text()
+            body = await resp.read()
     except Exception as e:
         print(f"Bing error for {name}: {e}")
-        await asyncio.sleep(RETRY_DELAY)  # Wait before continuing
+        adjust_bing_delay(None)  # Back off before the next search
         return []
 
     # Parse search results
-    soup = BeautifulSoup(html, "html.parser")
-    # Look for result links in Bing's HTML structure
-    for link in soup.select("h2 a, .b_algo h2 a, .algo h3 a"):
-        href = str(link.get("href", ""))  # Cast to string with default empty string
-        if href and href.startswith("http"):
-            try:
-                parsed = urllib.parse.urlparse(href)
-                if parsed.netloc and parsed.netloc not in hosts:
-                    hosts.append(parsed.netloc)
-                    if len(hosts) >= MAX_BING_RESULTS:
-                        break
-            except:
-                continue
+    for href in bing_result_links(body):
+        try:
+            parsed = urlsplit(href)
+            if parsed.netloc and parsed.netloc not in hosts:
+                hosts.append(parsed.netloc)
+                if len(hosts) >= MAX_BING_RESULTS:
+                    break
+        except:
+            continue
     
     return hosts
 
+async def probe_url(session: aiohttp.ClientSession, url: str, path: str) -> bool:
+    """HEAD the URL, then GET and scan the body only when the HEAD is not conclusive."""
+    # Endpoints are judged on their own answer, so their redirects aren't followed
+    is_endpoint = is_wp_endpoint(path)
+    try:
+        async with session.head(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT), allow_redirects=not is_endpoint) as resp:
+            if resp.status >= 400 and resp.status not in HEAD_UNRELIABLE:
+                return False
+            if is_endpoint and endpoint_hit(path, resp.status, resp.content_type):
+                return True
+    except asyncio.TimeoutError:
+        raise
+    except aiohttp.ClientError:
+        pass  # Some servers choke on HEAD alone; the GET decides
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
+        if resp.status != 200:
+            return False
+        html = await resp.text()
+        return bool(WP_REGEX.search(html))
+
 async def test_wordpress(session: aiohttp.ClientSession, domain: str, path: str = "/") -> bool:
     """Test if a domain+path shows WordPress indicators."""
-    url = f"https://{domain}{path}"
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
-            if resp.status != 200:
-                return False
-            html = await resp.text()
-            return bool(WP_REGEX.search(html))
+        return await probe_url(session, f"https://{domain}{path}", path)
     except Exception:
         # Try HTTP fallback
         try:
-            url_http = f"http://{domain}{path}"
-            async with session.get(url_http, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
-                if resp.status != 200:
-                    return False
-                html = await resp.text()
-                return bool(WP_REGEX.search(html))
+            return await probe_url(session, f"http://{domain}{path}", path)
         except Exception:
             return False
 
-async def check_idn_wordpress(session_search: aiohttp.ClientSession, 
-                             session_fetch: aiohttp.ClientSession, 
-                             name: str) -> bool:
+async def check_idn_wordpress(session: aiohttp.ClientSession, writer, name: str) -> bool:
     """Check if an IDN uses WordPress. Writes to CSV immediately if found. Returns True if found."""
     
     # Get search results from Bing
-    base_hosts = await bing_search(session_search, name)
+    base_hosts = await bing_search(session, name)
     if not base_hosts:
         return False
     
-    # Add delay between search requests
-    await asyncio.sleep(SEARCH_DELAY + random.random() * 0.1)
-    
     # Expand hosts with common WordPress sub-domains
     all_hosts = []
     for host in base_hosts:
@@ -136,9 +136,9 @@ async def check_idn_wordpress(session_search: aiohttp.ClientSession,
     # Test each host/path combination
     for host in all_hosts:
         for path in WP_PATHS:
-            if await test_wordpress(session_fetch, host, path):
+            if await test_wordpress(session, host, path):
                 # Write immediately to CSV
-                write_wordpress_site_to_csv(name, host)
+                write_wordpress_site_to_csv(writer, name, host)
                 return True
     
     return False
@@ -161,42 +161,45 @@ async def main():
     
     print(f"Total IDNs: {len(names)}")
     
-    # Initialize CSV file (create with header if doesn't exist)
-    if not Path(OUTPUT_CSV).exists():
-        write_wordpress_site_to_csv("", "")  # Creates header only
-        # Remove the empty row we just added
-        with open(OUTPUT_CSV, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        with open(OUTPUT_CSV, 'w', encoding='utf-8') as f:
-            f.write(lines[0])  # Keep only header
+    # Header is written once here; result writes never stat the file
+    write_header = not Path(OUTPUT_CSV).exists()
     
-    # Setup SSL and sessions
-    ssl_context = ssl.create_default_context()
-    connector = aiohttp.TCPConnector(ssl=ssl_context, limit=50)
+    # Setup session
+    connector = aiohttp.TCPConnector(ssl=SSL_CTX, limit=50)
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
     
     wordpress_count = 0
     
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as search_session, \
-               aiohttp.ClientSession(connector=connector, headers=headers) as fetch_session:
-        
-        # Process IDNs with semaphore for concurrency control
-        semaphore = asyncio.Semaphore(CONCURRENCY)
-        
-        async def process_idn(name: str) -> None:
-            nonlocal wordpress_count
-            async with semaphore:
-                found = await check_idn_wordpress(search_session, fetch_session, name)
-                if found:
-                    wordpress_count += 1
-        
-        # Create tasks and process with progress updates
-        tasks = [process_idn(name) for name in names]
+    # Line-buffered, so every hit is on disk as soon as it is found
+    with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8', buffering=1) as out_fh:
+        writer = csv.writer(out_fh)
+        if write_header:
+            writer.writerow(['name', 'domain'])
         
-        for i, task in enumerate(asyncio.as_completed(tasks), 1):
-            await task
-            if i % 50 == 0:
-                print(f"Processed {i}/{len(names)} – WP hits: {wordpress_count}")
+        # A single session owns the connector; sharing one connector between two
+        # sessions would let either close it under the other
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+            
+            # CONCURRENCY workers pull names off a queue instead of one task per IDN
+            queue: asyncio.Queue[str | None] = asyncio.Queue()
+            for name in names:
+                queue.put_nowait(name)
+            for _ in range(CONCURRENCY):
+                queue.put_nowait(None)
+            
+            processed = 0
+            
+            async def worker() -> None:
+                nonlocal wordpress_count, processed
+                while (name := await queue.get()) is not None:
+                    found = await check_idn_wordpress(session, writer, name)
+                    if found:
+                        wordpress_count += 1
+                    processed += 1
+                    if processed % 50 == 0:
+                        print(f"Processed {processed}/{len(names)} – WP hits: {wordpress_count}")
+            
+            await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
     
     print(f"Finished. WordPress sites detected: {wordpress_count} -> {OUTPUT_CSV}")
     print(f"Elapsed {time.time() - start_time:.1f}s")
@@ -1,15 +1,15 @@
 import asyncio
 import csv
 import random
-import re
 import ssl
 import sys
 import time
-import urllib.parse
 from pathlib import Path
+from urllib.parse import quote_plus, urlsplit
 
 import aiohttp
-from bs4 import BeautifulSoup
+
+from patterns import HEAD_UNRELIABLE, WP_REGEX, bing_result_links, endpoint_hit, is_wp_endpoint
 
 # -----------------------------
 # Configuration constants
@@ -40,10 +40,8 @@ WP_PATHS = [
     "/rss",  # alt feed
 ]
 
-# regex for WordPress fingerprints
-WP_RE = re.compile(
-    r"wp-content|wp-includes|wordpress|wp-json", re.I
-)
+# single TLS context for all connectors (loads the CA store once)
+SSL_CTX = ssl.create_default_context()
 
 # -----------------------------
 # Helpers
@@ -64,23 +62,19 @@ def load_names(path: str) -> list[str]:
 
 async def bing_search(session: aiohttp.ClientSession, name: str) -> list[str]:
     """Return up to MAX_BING_RESULTS unique hostnames from Bing HTML results."""
-    q = urllib.parse.quote_plus(f"{name} official website")
+    q = quote_plus(f"{name} official website")
     url = f"https://www.bing.com/search?q={q}&count={MAX_BING_RESULTS}"
     try:
         async with session.get(url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
-            html = await resp.text()
+            body = await resp.read()
     except Exception as e:
         print(f"Bing error for {name}: {e}", file=sys.stderr)
         return []
 
     hosts: list[str] = []
-    soup = BeautifulSoup(html, "html.parser")
     # Bing results are inside li.b_algo > h2 > a
-    for a in soup.select("li.b_algo h2 a"):
-        href = str(a.get("href") or "")
-        if not href or not href.startswith("http"):
-            continue
-        host = urllib.parse.urlsplit(href).hostname or ""
+    for href in bing_result_links(body):
+        host = urlsplit(href).hostname or ""
         if host and host not in hosts:
             hosts.append(host)
         if len(hosts) >= MAX_BING_RESULTS:
@@ -105,54 +99,102 @@ def expand_hosts(hosts: list[str]) -> list[str]:
     return list(dict.fromkeys(out))  # dedupe preserving order
 
 
+def http_fallback(url: str) -> str | None:
+    """Return the plain-HTTP form of an https:// URL, or None if it isn't one."""
+    if url.startswith("https://"):
+        return "http://" + url[len("https://"):]
+    return None
+
+
 async def fetch_text(session: aiohttp.ClientSession, url: str) -> str:
     try:
         async with session.get(url, timeout=aiohttp.ClientTimeout(total=15), allow_redirects=True) as resp:
             if resp.status < 400 and resp.content_type.startswith("text"):
                 return await resp.text(errors="ignore")
             return ""
+    except aiohttp.ClientSSLError:
+        # only a broken TLS setup is worth a second try over plain HTTP
+        fallback = http_fallback(url)
+        return await fetch_text(session, fallback) if fallback else ""
     except Exception:
         return ""
 
 
 async def head_ok(session: aiohttp.ClientSession, url: str) -> bool:
+    """Return False only if a HEAD shows the URL is dead; otherwise the GET decides."""
     try:
         async with session.head(url, timeout=aiohttp.ClientTimeout(total=10), allow_redirects=True) as resp:
-            return resp.status < 400
+            return resp.status < 400 or resp.status in HEAD_UNRELIABLE
+    except asyncio.TimeoutError:
+        return False
+    except aiohttp.ClientSSLError:
+        fallback = http_fallback(url)
+        return await head_ok(session, fallback) if fallback else False
+    except aiohttp.ClientError:
+        return True  # Some servers choke on HEAD alone
     except Exception:
         return False
 
 
+async def endpoint_head(session: aiohttp.ClientSession, url: str) -> bool | None:
+    """HEAD an endpoint URL without following redirects.
+
+    True if the answer is conclusive (see patterns.endpoint_hit), None if the
+    path is dead, False if only a body scan can tell.
+    """
+    try:
+        async with session.head(url, timeout=aiohttp.ClientTimeout(total=10), allow_redirects=False) as resp:
+            if resp.status >= 400 and resp.status not in HEAD_UNRELIABLE:
+                return None
+            return endpoint_hit(urlsplit(url).path, resp.status, resp.content_type)
+    except asyncio.TimeoutError:
+        return None
+    except aiohttp.ClientSSLError:
+        fallback = http_fallback(url)
+        return await endpoint_head(session, fallback) if fallback else None
+    except aiohttp.ClientError:
+        return False  # Some servers choke on HEAD alone; scan the body
+    except Exception:
+        return None
+
+
 async def test_host(session: aiohttp.ClientSession, host: str) -> bool:
-    """Check host for WP signs across several paths."""
-    schemes = ["https://", "http://"]
-    for scheme in schemes:
-        base_url = scheme + host
-        # first: fetch root
+    """Check host for WP signs across several paths.
+
+    Always probes over HTTPS; redirects are followed, and the helpers fall
+    back to plain HTTP only when the TLS handshake itself fails.
+    """
+    base_url = "https://" + host
+    # first: fetch root
+    if await head_ok(session, base_url):
         html = await fetch_text(session, base_url)
-        if WP_RE.search(html):
+        if WP_REGEX.search(html):
+            return True
+    # other paths
+    for p in WP_PATHS:
+        url = base_url.rstrip("/") + p
+        if is_wp_endpoint(p):
+            hit = await endpoint_head(session, url)
+            if hit is None:
+                continue
+            if hit:
+                return True
+        elif not await head_ok(session, url):
+            continue
+        html_path = await fetch_text(session, url)
+        if WP_REGEX.search(html_path):
             return True
-        # other paths
-        for p in WP_PATHS:
-            url = base_url.rstrip("/") + p
-            if p == "/wp-login.php":
-                if await head_ok(session, url):
-                    return True
-            else:
-                html_path = await fetch_text(session, url)
-                if WP_RE.search(html_path):
-                    return True
     return False
 
 
-async def process_name(name: str, search_sess: aiohttp.ClientSession, fetch_sess: aiohttp.ClientSession) -> tuple[str, str] | None:
+async def process_name(name: str, session: aiohttp.ClientSession) -> tuple[str, str] | None:
     await asyncio.sleep(SEARCH_DELAY + random.random() * 0.2)
-    hosts = await bing_search(search_sess, name)
+    hosts = await bing_search(session, name)
     if not hosts:
         return None
     hosts = expand_hosts(hosts)
     for host in hosts:
-        is_wp = await test_host(fetch_sess, host)
+        is_wp = await test_host(session, host)
         if is_wp:
             return name, host
     return None
@@ -162,32 +204,37 @@ async def run():
     names = load_names(NAMES_CSV)
     print(f"Total IDNs: {len(names)}")
 
-    sslctx = ssl.create_default_context()
     headers = {"User-Agent": "Mozilla/5.0"}
 
-    sem = asyncio.Semaphore(CONCURRENCY)
+    # CONCURRENCY workers pull names off a queue, so only that many coroutines
+    # exist at once instead of one parked task per IDN
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
+    for n in names:
+        queue.put_nowait(n)
+    for _ in range(CONCURRENCY):
+        queue.put_nowait(None)
 
     results: list[tuple[str, str]] = []
-
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=sslctx, limit_per_host=CONCURRENCY), headers=headers) as search_sess, \
-            aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=sslctx, limit_per_host=CONCURRENCY), headers=headers) as fetch_sess:
-
-        async def worker(name: str):
-            async with sem:
-                res = await process_name(name, search_sess, fetch_sess)
-                return res
-
-        tasks = [asyncio.create_task(worker(n)) for n in names]
-        for idx, task in enumerate(asyncio.as_completed(tasks), 1):
-            res = await task
-            if res:
-                results.append(res)
-            if idx % 50 == 0:
-                print(
-                    f"Processed {idx}/{len(names)} – WP hits: {len(results)}",
-                    file=sys.stdout,
-                    flush=True,
-                )
+    processed = 0
+
+    # one session (and connection pool) serves both Bing and the target hosts
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=SSL_CTX, limit_per_host=CONCURRENCY), headers=headers) as session:
+
+        async def worker():
+            nonlocal processed
+            while (name := await queue.get()) is not None:
+                res = await process_name(name, session)
+                if res:
+                    results.append(res)
+                processed += 1
+                if processed % 50 == 0:
+                    print(
+                        f"Processed {processed}/{len(names)} – WP hits: {len(results)}",
+                        file=sys.stdout,
+                        flush=True,
+                    )
+
+        await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
 
     results_sorted = sorted(results, key=lambda x: x[0].lower())
     with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
@@ -5,67 +5,107 @@ This version ensures we don't lose data if the process crashes.
 """
 
 import asyncio
+import atexit
 import csv
-import os
 import random
 import re
-import ssl
+import signal
 import sys
 import time
 import urllib.parse
+from collections import defaultdict
 from pathlib import Path
 
 import aiohttp
-from bs4 import BeautifulSoup
+
+from patterns import bing_result_links
 
 # Configuration
 NAMES_CSV = "acuity_idns.csv"
 OUTPUT_CSV = "wordpress_idns.csv"
 SEARCH_DELAY = 15.0  # Very conservative delay
-FETCH_DELAY = 3.0
-MAX_CONCURRENT = 1  # Sequential processing
+FETCH_DELAY = 3.0  # Minimum spacing between fetches from the same host
+MAX_CONCURRENT = 8  # IDNs in flight at once
 MAX_BING_RESULTS = 2
 TIMEOUT = 45
 MAX_RETRIES = 2
+FLUSH_INTERVAL = 2.0  # Max seconds a found site may sit in the CSV buffer
+SCAN_CHUNK = 16384  # Bytes read per step while scanning a page
+SCAN_OVERLAP = 64  # Re-scanned tail so a match can straddle two chunks
+MAX_SCAN_BYTES = 65536  # Bytes requested (Range) and scanned per page
+HEAD_TIMEOUT = 10
+
+# Request settings shared by every call, built once at import
+_TIMEOUT = aiohttp.ClientTimeout(total=TIMEOUT, connect=10, sock_read=20)
+_HEAD_TIMEOUT = aiohttp.ClientTimeout(total=HEAD_TIMEOUT)
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+}
 
-# WordPress detection patterns
+# WordPress detection patterns, most specific first; loose tokens such as
+# wp_ and wpdb are left out because they turn up in unrelated minified JS
 WP_PATTERNS = [
-    r'/wp-content/',
-    r'/wp-includes/',
-    r'/wp-admin/',
+    r'wp-content/',
+    r'wp-includes/',
     r'wp-json',
-    r'WordPress',
-    r'wp_',
-    r'wpdb',
+    r'<meta name="generator" content="WordPress',
     r'wp-login',
-    r'wp-config'
+    r'wp-admin/'
 ]
-WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
+# Bytes pattern, matched against the raw body as it streams in
+WP_REGEX = re.compile('|'.join(WP_PATTERNS).encode(), re.IGNORECASE)
 
 # Sub-domain prefixes to test
 WP_PREFIXES = ['www', 'blog', 'news', 'stories', 'newsroom', 'media']
 
+# Only these content types are worth downloading after the HEAD check
+PAGE_TYPES = ('text/html', 'application/json')
+# Statuses meaning the server just doesn't do HEAD; fall through to the GET
+HEAD_UNSUPPORTED = (405, 501)
+RANGE_HEADERS = {'Range': f'bytes=0-{MAX_SCAN_BYTES - 1}'}
+
+# Results CSV, opened once in main() and written through for the whole run;
+# rows are buffered and flushed at most every FLUSH_INTERVAL seconds
+_csv_fh = None
+_csv_writer = None
+_last_flush = 0.0
+
+# An IDN's test URLs mostly share one host, so politeness is per host: one
+# fetch at a time from each, FETCH_DELAY apart. Different hosts (and so
+# different IDNs) never wait on each other.
+HOST_LOCKS = defaultdict(asyncio.Lock)
+_host_last = {}  # host -> loop time its last fetch started
+
+# Bing searches from all MAX_CONCURRENT IDNs share one gate, so Bing still
+# sees one query per SEARCH_DELAY (plus jitter) however many are in flight
+_bing_lock = asyncio.Lock()
+_last_search = 0.0
+
 def log_message(msg):
     """Print timestamped log message"""
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {msg}", flush=True)
 
+def flush_results(force=False):
+    """Flush buffered CSV rows if FLUSH_INTERVAL has passed (or always, with force)"""
+    global _last_flush
+    if _csv_fh is None or _csv_fh.closed:
+        return
+    now = time.monotonic()
+    if force or now - _last_flush >= FLUSH_INTERVAL:
+        _csv_fh.flush()
+        _last_flush = now
+
+def handle_sigterm(signum, frame):
+    """Flush what has been found so far, then exit as SIGTERM would"""
+    flush_results(force=True)
+    sys.exit(128 + signum)
+
 def write_wordpress_site(name, domain):
-    """Immediately write a WordPress site to CSV"""
+    """Write a WordPress site to CSV; it reaches disk within FLUSH_INTERVAL"""
     try:
-        # Check if file exists to determine if we need headers
-        file_exists = os.path.exists(OUTPUT_CSV)
-        
-        with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            
-            # Write headers if file is new
-            if not file_exists:
-                writer.writerow(['name', 'domain'])
-            
-            # Write the WordPress site
-            writer.writerow([name, domain])
-            f.flush()  # Force write to disk
+        _csv_writer.writerow([name, domain])
+        flush_results()
         
         log_message(f"✓ WordPress found: {name} -> {domain}")
         return True
@@ -73,30 +113,37 @@ def write_wordpress_site(name, domain):
         log_message(f"Error writing to CSV: {e}")
         return False
 
+async def wait_for_bing():
+    """Sleep until it is this IDN's turn to search Bing"""
+    global _last_search
+    async with _bing_lock:
+        wait = _last_search + SEARCH_DELAY + random.uniform(0, 2) - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _last_search = time.monotonic()
+
 async def search_bing(session, query):
     """Search Bing and return domain list"""
     try:
+        await wait_for_bing()
         search_url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
         
-        async with session.get(search_url, timeout=TIMEOUT) as response:
+        async with session.get(search_url, timeout=_TIMEOUT) as response:
             if response.status != 200:
                 return []
             
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
+            body = await response.read()
             
             domains = []
-            for link in soup.select("h2 a, .b_algo h2 a"):
-                href = link.get("href")
-                if href and isinstance(href, str) and href.startswith("http"):
-                    try:
-                        parsed = urllib.parse.urlparse(href)
-                        if parsed.netloc:
-                            domains.append(parsed.netloc)
-                            if len(domains) >= MAX_BING_RESULTS:
-                                break
-                    except:
-                        continue
+            for href in bing_result_links(body):
+                try:
+                    parsed = urllib.parse.urlparse(href)
+                    if parsed.netloc:
+                        domains.append(parsed.netloc)
+                        if len(domains) >= MAX_BING_RESULTS:
+                            break
+                except:
+                    continue
             
             return domains
             
@@ -104,33 +151,70 @@ async def search_bing(session, query):
         log_message(f"Bing search error for '{query}': {e}")
         return []
 
+async def scan_url(session, url, ssl=True):
+    """HEAD-check a URL, then scan the start of its body for WordPress fingerprints"""
+    # Rule out errors, redirects to nowhere and non-page content
+    # before paying for a body
+    async with session.head(url, allow_redirects=True, timeout=_HEAD_TIMEOUT, ssl=ssl) as response:
+        if response.status not in HEAD_UNSUPPORTED:
+            content_type = response.headers.get('Content-Type', '')
+            if response.status != 200 or (content_type and not content_type.startswith(PAGE_TYPES)):
+                return False
+    
+    async with session.get(url, timeout=_TIMEOUT, headers=RANGE_HEADERS, ssl=ssl) as response:
+        if response.status not in (200, 206):
+            return False
+        
+        # Stop downloading at the first fingerprint
+        buf = bytearray()
+        async for chunk in response.content.iter_chunked(SCAN_CHUNK):
+            start = max(0, len(buf) - SCAN_OVERLAP)
+            buf.extend(chunk)
+            if WP_REGEX.search(buf, start):
+                return True
+            if len(buf) >= MAX_SCAN_BYTES:
+                break
+        return False
+
+async def wait_for_host(host):
+    """Sleep until FETCH_DELAY has passed since the last fetch from host; call under HOST_LOCKS[host]"""
+    loop = asyncio.get_running_loop()
+    last = _host_last.get(host)
+    if last is not None:
+        await asyncio.sleep(max(0, last + FETCH_DELAY - loop.time()))
+    _host_last[host] = loop.time()
+
 async def test_wordpress(session, url):
     """Test if a URL uses WordPress"""
+    host = urllib.parse.urlsplit(url).netloc
     try:
-        async with session.get(url, timeout=TIMEOUT) as response:
-            if response.status != 200:
-                return False
-            
-            html = await response.text()
-            return bool(WP_REGEX.search(html))
+        async with HOST_LOCKS[host]:
+            await wait_for_host(host)
+            try:
+                return await scan_url(session, url)
+            except aiohttp.ClientConnectorCertificateError:
+                # Only hosts with broken certificates go unverified
+                return await scan_url(session, url, ssl=False)
             
     except Exception as e:
         return False
 
-async def process_idn(session, search_session, name, processed_count, total_count):
+async def process_idn(session, name, processed_count, total_count):
     """Process a single IDN and return True if WordPress found"""
     try:
         log_message(f"Processing {processed_count}/{total_count}: {name}")
         
         # Search for the IDN
-        domains = await search_bing(search_session, name)
-        await asyncio.sleep(SEARCH_DELAY + random.uniform(0, 2))
+        domains = await search_bing(session, name)
         
         if not domains:
             return False
         
-        # Test each domain for WordPress
-        for domain in domains:
+        # Collect every test URL for every domain, then probe them together.
+        # Hosts are compared in canonical form (lowercase, no stray dots) so
+        # foo.com and WWW.foo.com. don't get probed twice.
+        candidates = {}
+        for domain in dict.fromkeys(d.lower().strip('.') for d in domains):
             # Test main domain and common WordPress paths
             test_urls = [
                 f"https://{domain}",
@@ -140,24 +224,33 @@ async def process_idn(session, search_session, name, processed_count, total_coun
                 f"https://{domain}/news/"
             ]
             
-            # Also test with www prefix if not already present
-            if not domain.startswith('www.'):
+            # Also test the www host, but only for a bare domain
+            if domain.count('.') == 1:
                 test_urls.extend([
                     f"https://www.{domain}",
                     f"https://www.{domain}/wp-json/wp/v2/"
                 ])
             
             for url in test_urls:
-                try:
-                    if await test_wordpress(session, url):
-                        # Found WordPress! Write immediately to CSV
-                        write_wordpress_site(name, domain)
-                        return True
-                    
-                    await asyncio.sleep(FETCH_DELAY)
-                    
-                except Exception as e:
-                    continue
+                candidates.setdefault(url, domain)
+        
+        async def probe(domain, url):
+            return domain if await test_wordpress(session, url) else None
+        
+        tasks = [asyncio.create_task(probe(domain, url)) for url, domain in candidates.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                domain = await next_done
+                if domain:
+                    # Found WordPress! Write immediately to CSV
+                    write_wordpress_site(name, domain)
+                    return True
+        finally:
+            # The first hit wins; the remaining probes are abandoned, and
+            # waited for so none of them outlives this IDN
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         
         return False
         
@@ -192,51 +285,66 @@ async def main():
         return
     
     # Initialize CSV file
+    global _csv_fh, _csv_writer
     try:
-        with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['name', 'domain'])
+        _csv_fh = open(OUTPUT_CSV, 'w', newline='', encoding='utf-8')
+        _csv_writer = csv.writer(_csv_fh)
+        _csv_writer.writerow(['name', 'domain'])
+        flush_results(force=True)
+        # Ctrl-C unwinds normally and exits through atexit; SIGTERM (e.g. from
+        # start_crawlers or the host) would otherwise drop buffered rows
+        atexit.register(flush_results, force=True)
+        signal.signal(signal.SIGTERM, handle_sigterm)
         log_message(f"Initialized output file: {OUTPUT_CSV}")
     except Exception as e:
         log_message(f"Error initializing CSV: {e}")
         return
     
-    # Setup sessions
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
-    
+    # Setup sessions; certificates are verified unless a host's turn out to be
+    # broken (see test_wordpress), which keeps TLS session resumption working
     connector = aiohttp.TCPConnector(
-        ssl=ssl_context,
-        limit=10,
-        limit_per_host=5,
-        keepalive_timeout=30
+        ssl=True,
+        limit=50,
+        limit_per_host=6,
+        ttl_dns_cache=300,
+        use_dns_cache=True,
+        keepalive_timeout=60,
+        happy_eyeballs_delay=0.25,  # don't stall on a dead IPv6 route
+        enable_cleanup_closed=True
     )
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    }
-    
     wordpress_found = 0
     start_time = time.time()
     
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
-        async with aiohttp.ClientSession(connector=connector, headers=headers) as search_session:
-            
-            for i, name in enumerate(names, 1):
+    # One session owns the connector and serves both Bing and the target sites
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+        
+        sem = asyncio.Semaphore(MAX_CONCURRENT)
+        processed = 0
+        
+        # write_wordpress_site is synchronous, so a row is always written in
+        # one go between awaits; the concurrent IDNs need no lock around it
+        async def guarded(i, name):
+            nonlocal wordpress_found, processed
+            async with sem:
                 try:
-                    found = await process_idn(session, search_session, name, i, len(names))
+                    found = await process_idn(session, name, i, len(names))
                     if found:
                         wordpress_found += 1
-                    
-                    # Progress update every 50 IDNs
-                    if i % 50 == 0:
-                        elapsed = time.time() - start_time
-                        log_message(f"Progress: {i}/{len(names)} processed, {wordpress_found} WordPress sites found, {elapsed:.1f}s elapsed")
-                    
                 except Exception as e:
                     log_message(f"Error with IDN {i} ({name}): {e}")
-                    continue
+                
+                processed += 1
+                # A hit written during a quiet stretch still gets flushed
+                flush_results()
+                # Progress update every 50 IDNs
+                if processed % 50 == 0:
+                    elapsed = time.time() - start_time
+                    log_message(f"Progress: {processed}/{len(names)} processed, {wordpress_found} WordPress sites found, {elapsed:.1f}s elapsed")
+        
+        await asyncio.gather(*[guarded(i, name) for i, name in enumerate(names, 1)])
+    
+    _csv_fh.close()
     
     elapsed = time.time() - start_time
     log_message(f"Crawler completed! Found {wordpress_found} WordPress sites in {elapsed:.1f}s")
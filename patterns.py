@@ -0,0 +1,91 @@
+"""
+Shared regular expressions for the WordPress crawlers.
+
+Every pattern is compiled exactly once, here, at import time. Crawlers should
+import these re.Pattern objects rather than calling re.search(pattern_str, ...)
+on hot paths, which costs a lookup in re's internal pattern cache per call.
+Bing result links are pulled out without a regex at all; see
+bing_result_links(). The WordPress endpoint rules the HEAD-probing
+crawlers share live here too (WP_ENDPOINTS, HEAD_UNRELIABLE,
+endpoint_hit()).
+"""
+
+import re
+
+# WordPress fingerprints found in page HTML (fixed-width alternatives only, so
+# the scan never backtracks; a generator meta tag is already caught by "wordpress")
+WP_PATTERNS = [
+    r'wp-content[/\\]',
+    r'wp-includes[/\\]',
+    r'wp-admin[/\\]',
+    r'/wp-json/',
+    r'wordpress',
+    r'wp_version',
+    r'wp-embed',
+    r'wp_enqueue_script',
+    r'wpdb',
+    r'wp_head\(\)',
+    r'wp_footer\(\)'
+]
+
+WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
+
+# Compiled as bytes so streamed chunks can be scanned without decoding
+WP_BYTES_REGEX = re.compile('|'.join(WP_PATTERNS).encode(), re.IGNORECASE)
+
+# A JSON document's first non-whitespace byte; matched in place, so checking
+# a response body doesn't copy it the way body.lstrip() would
+JSON_START_RE = re.compile(rb'[ \t\r\n]*[\[{]')
+
+# WordPress-only endpoint paths, matched as prefixes by is_wp_endpoint().
+# Their HEAD isn't followed through redirects, and only the REST route
+# answering 2xx JSON itself is conclusive (endpoint_hit); anything else falls
+# through to the body scan, since catch-all sites answer 200 (HTML) or
+# redirect to / for any path.
+WP_ENDPOINTS = ('/wp-json', '/wp-login.php', '/wp-admin', '/xmlrpc.php')
+
+# HEAD answers that say nothing about the GET: HEAD not implemented (405,
+# 501), or refused by a WAF/CDN that serves GET normally (403). The GET decides.
+HEAD_UNRELIABLE = (403, 405, 501)
+
+# Organic results sit inside <ol id="b_results">, after tens of KB of inline CSS/JS
+BING_RESULTS_MARKER = b'id="b_results"'
+
+# How far past an <h2 the result link's href may start
+BING_HREF_WINDOW = 512
+
+
+def bing_result_links(body):
+    """Yield result URLs from a raw Bing results page, in page order.
+
+    Each organic result is an <h2><a href="...">. Plain bytes.find() calls
+    hop from one <h2 to the next and look for href=" only inside that
+    heading, so the scan never runs a regex over the page and stops as
+    soon as the caller has enough links.
+    """
+    pos = max(body.find(BING_RESULTS_MARKER), 0)
+    while (h2 := body.find(b'<h2', pos)) >= 0:
+        pos = h2 + 3
+        close = body.find(b'</h2>', pos, h2 + BING_HREF_WINDOW)
+        href = body.find(b'href="', pos, close if close >= 0 else h2 + BING_HREF_WINDOW)
+        if href < 0:
+            continue
+        start = href + 6
+        end = body.find(b'"', start)
+        if end < 0:
+            return
+        pos = end
+        url = body[start:end]
+        if url.startswith((b'http://', b'https://')):
+            yield url.decode('ascii', 'ignore')
+
+
+def is_wp_endpoint(path):
+    """Return True if path is one of WP_ENDPOINTS or lies below one."""
+    return path.startswith(WP_ENDPOINTS)
+
+
+def endpoint_hit(path, status, content_type):
+    """Return True if an un-redirected HEAD answer for an endpoint path proves WordPress."""
+    return (200 <= status < 300 and path.startswith('/wp-json')
+            and content_type == 'application/json')
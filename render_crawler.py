@@ -4,18 +4,24 @@ Render-optimized WordPress detection crawler.
 Designed to run as a web service with progress tracking.
 """
 
+import asyncio
 import csv
 import os
+import re
+import ssl
 import threading
-import time
 from datetime import datetime
-from flask import Flask, jsonify, send_file
+from flask import Flask, Response, jsonify, send_file
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+import aiohttp
 import urllib.parse
 import base64
 import json
 
+from patterns import bing_result_links
+
 app = Flask(__name__)
 
 # Configuration
@@ -24,12 +30,32 @@ OUTPUT_CSV = "wordpress_idns.csv"
 PROGRESS_FILE = "crawler_progress.json"
 SEARCH_DELAY = 8.0  # Conservative delay
 TIMEOUT = 30
+SCAN_CHUNK = 16384
+SCAN_OVERLAP = 64
+MAX_SCAN_BYTES = 65536
+HEAD_TIMEOUT = 10
+
+# Shared by every crawler session and request
+_TIMEOUT = aiohttp.ClientTimeout(total=TIMEOUT, connect=10, sock_read=20)
+_HEAD_TIMEOUT = aiohttp.ClientTimeout(total=HEAD_TIMEOUT)
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# One TLS context for every crawl, instead of a fresh one per connector
+SSL_CTX = ssl.create_default_context()
 
 # GitHub commit configuration (optional)
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")  # Personal access token with repo scope
 GITHUB_REPO  = os.getenv("GITHUB_REPO")   # e.g. "LukeWolfram3/Sylke"
 GITHUB_PATH  = os.getenv("GITHUB_CSV_PATH", OUTPUT_CSV)  # path within repo
 
+# Pooled session for the GitHub API, so the SHA lookup and the PUT (and any
+# later exports) reuse one keep-alive connection
+_github_session = requests.Session()
+_github_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=1)
+_github_session.mount("https://", _github_adapter)
+
 # Global state
 crawler_state = {
     "running": False,
@@ -41,6 +67,15 @@ crawler_state = {
     "last_update": None
 }
 
+# Results CSV, held open for the duration of a crawl (see open_results_csv)
+_csv_lock = threading.Lock()
+_csv_fh = None
+_csv_writer = None
+
+# Names already in the results CSV; read from disk once, then kept current
+# by write_wordpress_site
+_processed_set = set()
+
 # WordPress detection patterns
 WP_PATTERNS = [
     r'/wp-content/',
@@ -50,6 +85,14 @@ WP_PATTERNS = [
     r'WordPress',
     r'wp-login'
 ]
+WP_REGEX = re.compile('|'.join(WP_PATTERNS).encode(), re.IGNORECASE)  # scanned on raw bytes
+
+# HEAD pre-check: pages of other types are skipped, and servers that reject
+# HEAD outright still get the GET
+PAGE_TYPES = ('text/html', 'application/json')
+HEAD_UNSUPPORTED = (405, 501)
+# Servers that honour Range send only the part that gets scanned
+RANGE_HEADERS = {'Range': f'bytes=0-{MAX_SCAN_BYTES - 1}'}
 
 def log_message(msg):
     """Log with timestamp"""
@@ -89,25 +132,31 @@ def get_processed_idns():
         log_message(f"Error reading processed IDNs: {e}")
     return processed
 
+def open_results_csv():
+    """Write the CSV header if needed, then open the results file for appending"""
+    global _csv_fh, _csv_writer
+    if not os.path.exists(OUTPUT_CSV) or os.path.getsize(OUTPUT_CSV) == 0:
+        with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['name', 'domain'])
+    
+    # Line-buffered so /download and the GitHub export always see every row
+    _csv_fh = open(OUTPUT_CSV, 'a', newline='', encoding='utf-8', buffering=1)
+    _csv_writer = csv.writer(_csv_fh)
+
+def close_results_csv():
+    """Close the results file opened by open_results_csv"""
+    global _csv_fh, _csv_writer
+    with _csv_lock:
+        if _csv_fh is not None:
+            _csv_fh.close()
+        _csv_fh = _csv_writer = None
+
 def write_wordpress_site(name, domain):
     """Write WordPress site to CSV immediately"""
     try:
-        # Check if file exists and has header
-        file_exists = os.path.exists(OUTPUT_CSV)
-        needs_header = True
-        
-        if file_exists:
-            with open(OUTPUT_CSV, 'r', encoding='utf-8') as f:
-                first_line = f.readline().strip()
-                if first_line == 'name,domain':
-                    needs_header = False
-        
-        # Write to file
-        with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if needs_header:
-                writer.writerow(['name', 'domain'])
-            writer.writerow([name, domain])
+        with _csv_lock:
+            _csv_writer.writerow([name, domain])
+            _processed_set.add(name)
         
         log_message(f"✓ WordPress found: {name} -> {domain}")
         return True
@@ -115,64 +164,65 @@ def write_wordpress_site(name, domain):
         log_message(f"Error writing to CSV: {e}")
         return False
 
-def bing_search(query):
+async def bing_search(session, query):
     """Search Bing for domains related to query"""
     try:
         encoded_query = urllib.parse.quote(query)
         url = f"https://www.bing.com/search?q={encoded_query}"
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=TIMEOUT)
-        response.raise_for_status()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            body = await response.read()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
         domains = []
         
-        # Extract domains from search results
-        for link in soup.select('h2 a, .b_algo h2 a'):
-            href = link.get('href')
-            if href and isinstance(href, str) and href.startswith('http'):
-                try:
-                    parsed = urllib.parse.urlparse(href)
-                    if parsed.netloc and parsed.netloc not in domains:
-                        domains.append(parsed.netloc)
-                        if len(domains) >= 3:  # Limit results
-                            break
-                except:
-                    continue
+        # Extract domains from search results, scanning the undecoded body
+        for href in bing_result_links(body):
+            try:
+                parsed = urllib.parse.urlparse(href)
+                if parsed.netloc and parsed.netloc not in domains:
+                    domains.append(parsed.netloc)
+                    if len(domains) >= 3:  # Limit results
+                        break
+            except:
+                continue
         
         return domains
     except Exception as e:
         log_message(f"Bing search error for '{query}': {e}")
         return []
 
-def test_wordpress(url):
+async def test_wordpress(session, url):
     """Test if a URL uses WordPress"""
     try:
         if not url.startswith('http'):
             url = f"https://{url}"
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
-        response.raise_for_status()
+        async with session.head(url, allow_redirects=True, timeout=_HEAD_TIMEOUT) as response:
+            if response.status not in HEAD_UNSUPPORTED:
+                content_type = response.headers.get('Content-Type', '')
+                if response.status != 200 or (content_type and not content_type.startswith(PAGE_TYPES)):
+                    return False
         
-        # Check for WordPress patterns
-        content = response.text.lower()
-        for pattern in WP_PATTERNS:
-            if pattern.lower() in content:
-                return True
+        async with session.get(url, allow_redirects=True, headers=RANGE_HEADERS) as response:
+            response.raise_for_status()
+            
+            # Check for WordPress patterns chunk by chunk, closing the
+            # connection as soon as one turns up
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(SCAN_CHUNK):
+                start = max(0, len(buf) - SCAN_OVERLAP)
+                buf.extend(chunk)
+                if WP_REGEX.search(buf, start):
+                    return True
+                if len(buf) >= MAX_SCAN_BYTES:
+                    break
         
         return False
     except Exception as e:
         return False
 
-def process_idn(name):
+async def process_idn(session, name):
     """Process a single IDN"""
     global crawler_state
     
@@ -180,50 +230,65 @@ def process_idn(name):
     crawler_state["last_update"] = datetime.now().isoformat()
     
     # Search for domains
-    domains = bing_search(name)
+    domains = await bing_search(session, name)
     if not domains:
         return False
     
-    # Test each domain for WordPress
-    for domain in domains:
-        if test_wordpress(domain):
+    # Test all candidate domains at once; the first one (in Bing's order)
+    # that looks like WordPress is recorded
+    results = await asyncio.gather(*[test_wordpress(session, d) for d in domains], return_exceptions=True)
+    for domain, is_wp in zip(domains, results):
+        if is_wp is True:
             write_wordpress_site(name, domain)
             crawler_state["found"] += 1
             return True
-        time.sleep(2)  # Small delay between tests
     
     return False
 
-def run_crawler():
-    """Main crawler function"""
+async def run_crawler():
+    """Main crawler function, run on its own event loop in the crawler thread"""
     global crawler_state
     
     try:
         crawler_state["running"] = True
         crawler_state["start_time"] = datetime.now().isoformat()
         
+        open_results_csv()
+        
         # Load IDNs
         all_idns = load_idns()
-        processed = get_processed_idns()
-        remaining = [idn for idn in all_idns if idn not in processed]
+        if not _processed_set:
+            _processed_set.update(get_processed_idns())
+        remaining = [idn for idn in all_idns if idn not in _processed_set]
         
         crawler_state["total"] = len(remaining)
         crawler_state["progress"] = 0
         
         log_message(f"Starting crawler: {len(remaining)} IDNs to process")
         
-        for i, idn in enumerate(remaining):
-            if not crawler_state["running"]:
-                break
+        # One session for the whole run, so searches and probes reuse
+        # connections, TLS state and cached DNS answers
+        connector = aiohttp.TCPConnector(
+            ssl=SSL_CTX,
+            limit=50,
+            limit_per_host=6,
+            ttl_dns_cache=300,
+            use_dns_cache=True,
+            keepalive_timeout=60
+        )
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=_TIMEOUT) as session:
+            for i, idn in enumerate(remaining):
+                if not crawler_state["running"]:
+                    break
+                    
+                await process_idn(session, idn)
+                crawler_state["progress"] = i + 1
                 
-            process_idn(idn)
-            crawler_state["progress"] = i + 1
-            
-            # Progress update every 25 IDNs
-            if (i + 1) % 25 == 0:
-                log_message(f"Progress: {i+1}/{len(remaining)} processed, {crawler_state['found']} WordPress sites found")
-            
-            time.sleep(SEARCH_DELAY)
+                # Progress update every 25 IDNs
+                if (i + 1) % 25 == 0:
+                    log_message(f"Progress: {i+1}/{len(remaining)} processed, {crawler_state['found']} WordPress sites found")
+                
+                await asyncio.sleep(SEARCH_DELAY)
         
         log_message(f"Crawler completed! Found {crawler_state['found']} WordPress sites")
         
@@ -233,6 +298,7 @@ def run_crawler():
     except Exception as e:
         log_message(f"Crawler error: {e}")
     finally:
+        close_results_csv()
         crawler_state["running"] = False
 
 def commit_csv_to_github(message: str = "Update wordpress_idns.csv"):
@@ -249,7 +315,7 @@ def commit_csv_to_github(message: str = "Update wordpress_idns.csv"):
     }
     try:
         # Check if file exists to get its SHA
-        resp = requests.get(url, headers=headers, timeout=15)
+        resp = _github_session.get(url, headers=headers, timeout=15)
         sha = None
         if resp.status_code == 200:
             sha = resp.json().get("sha")
@@ -265,7 +331,7 @@ def commit_csv_to_github(message: str = "Update wordpress_idns.csv"):
         if sha:
             payload["sha"] = sha
 
-        resp = requests.put(url, headers=headers, data=json.dumps(payload), timeout=30)
+        resp = _github_session.put(url, headers=headers, data=json.dumps(payload), timeout=30)
         if resp.status_code in (200, 201):
             log_message("✓ CSV committed to GitHub")
             return True
@@ -276,10 +342,14 @@ def commit_csv_to_github(message: str = "Update wordpress_idns.csv"):
         log_message(f"Error committing CSV to GitHub: {e}")
         return False
 
+def orjson_response(data):
+    """JSON response serialized with orjson; used by the endpoints that get polled"""
+    return Response(orjson.dumps(data), mimetype='application/json')
+
 @app.route('/')
 def home():
     """Home page with status"""
-    return jsonify({
+    return orjson_response({
         "status": "WordPress IDN Crawler",
         "running": crawler_state["running"],
         "progress": f"{crawler_state['progress']}/{crawler_state['total']}",
@@ -296,7 +366,7 @@ def start_crawler():
         return jsonify({"error": "Crawler already running"})
     
     # Start crawler in background thread
-    thread = threading.Thread(target=run_crawler, daemon=True)
+    thread = threading.Thread(target=lambda: asyncio.run(run_crawler()), daemon=True)
     thread.start()
     
     return jsonify({"message": "Crawler started", "status": "running"})
@@ -310,7 +380,7 @@ def stop_crawler():
 @app.route('/status')
 def get_status():
     """Get current status"""
-    return jsonify(crawler_state)
+    return orjson_response(crawler_state)
 
 @app.route('/download')
 def download_results():
@@ -16,7 +16,8 @@ import urllib.parse
 from pathlib import Path
 
 import aiohttp
-from bs4 import BeautifulSoup
+
+from patterns import JSON_START_RE, bing_result_links
 
 # Configuration
 NAMES_CSV = "acuity_idns.csv"
@@ -27,28 +28,28 @@ FETCH_DELAY_BASE  = 2.0
 SEARCH_DELAY = SEARCH_DELAY_BASE / 2
 FETCH_DELAY  = FETCH_DELAY_BASE  / 2
 
-MAX_CONCURRENT = 1  # Sequential processing only
+MAX_CONCURRENT = 8  # IDNs processed at once
 MAX_BING_RESULTS = 2  # Even fewer results to reduce load
 TIMEOUT = 45  # Longer timeout
 MAX_RETRIES = 2
 
+# Built once and shared by every request
+_TIMEOUT = aiohttp.ClientTimeout(total=TIMEOUT, connect=10, sock_read=20)
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
 # Sub-domain prefixes to test
 WP_PREFIXES = ["blog.", "news.", "www."]
 
 # Paths to test on each domain
 WP_PATHS = ["/", "/blog", "/wp-json", "/feed"]
 
-# WordPress detection patterns
-WP_PATTERNS = [
-    r'wp-content/',
-    r'wp-includes/',
-    r'wordpress',
-    r'<meta name="generator" content="WordPress',
-    r'/wp-json/',
-    r'wp_enqueue_script',
-    r'wp-admin',
-]
-WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
+# REST API index checks, run on the first REST_PEEK_BYTES of /wp-json/
+REST_PEEK_BYTES = 4096
+REST_NAMESPACES_RE = re.compile(rb'"namespaces"\s*:\s*\[')
+REST_NAME_RE = re.compile(rb'"name"\s*:\s*"((?:[^"\\]|\\.)*)"')
+REST_PEEK_HEADERS = {"Range": f"bytes=0-{REST_PEEK_BYTES - 1}"}
 
 # -------------------------------------------------------------
 # Relevancy filtering helpers
@@ -60,10 +61,26 @@ STOP_WORDS = {
     'medical', 'healthcare', 'health', 'hospital', 'hospitals', 'clinic', 'clinics', 'care'
 }
 
+_NON_ALPHA = re.compile(r'[^a-zA-Z]')
+
 def tokenize(text: str) -> set[str]:
-    tokens = re.sub(r'[^a-zA-Z]', ' ', text).lower().split()
+    tokens = _NON_ALPHA.sub(' ', text).lower().split()
     return {t for t in tokens if t and t not in STOP_WORDS}
 
+# MAX_CONCURRENT IDNs search at once, but Bing should see them one at a
+# time; every search waits its turn here, SEARCH_DELAY (plus jitter) apart
+_bing_lock = asyncio.Lock()
+_last_search = 0.0
+
+async def wait_for_bing() -> None:
+    """Sleep until this IDN may send the next Bing search."""
+    global _last_search
+    async with _bing_lock:
+        wait = _last_search + SEARCH_DELAY + random.uniform(1, 3) - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _last_search = time.monotonic()
+
 def get_processed_names():
     """Get list of already processed names from CSV to avoid duplicates."""
     processed = set()
@@ -108,26 +125,22 @@ async def safe_bing_search(session: aiohttp.ClientSession, name: str) -> list[st
         try:
             print(f"Searching Bing for: {name} (attempt {attempt + 1})")
             
-            # Random delay
-            await asyncio.sleep(SEARCH_DELAY + random.uniform(1, 3))
+            await wait_for_bing()
             
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
+            async with session.get(url, timeout=_TIMEOUT) as resp:
                 if resp.status == 200:
-                    html = await resp.text()
-                    soup = BeautifulSoup(html, "html.parser")
+                    body = await resp.read()
                     
-                    # Parse Bing search results
-                    for link in soup.select("h2 a, .b_algo h2 a"):
-                        href = link.get("href")
-                        if href and isinstance(href, str) and href.startswith("http"):
-                            try:
-                                parsed = urllib.parse.urlparse(href)
-                                if parsed.netloc and parsed.netloc not in hosts:
-                                    hosts.append(parsed.netloc)
-                                    if len(hosts) >= MAX_BING_RESULTS:
-                                        break
-                            except:
-                                continue
+                    # Parse Bing search results straight from the raw bytes
+                    for href in bing_result_links(body):
+                        try:
+                            parsed = urllib.parse.urlparse(href)
+                            if parsed.netloc and parsed.netloc not in hosts:
+                                hosts.append(parsed.netloc)
+                                if len(hosts) >= MAX_BING_RESULTS:
+                                    break
+                        except:
+                            continue
                     break
                 else:
                     # Handle 429 rate-limit
@@ -150,45 +163,70 @@ async def safe_bing_search(session: aiohttp.ClientSession, name: str) -> list[st
     
     return hosts
 
+async def fetch_rest(session: aiohttp.ClientSession, domain: str, path: str,
+                     peek: bool = False) -> bytes | None:
+    """GET a REST path and return the JSON body, or None. With peek, only the
+    first REST_PEEK_BYTES are requested and read.
+
+    https is tried first; http only when https can't connect at all, not when
+    it answers with an error status.
+    """
+    global FETCH_DELAY  # declare early
+    headers = REST_PEEK_HEADERS if peek else None
+    limit = REST_PEEK_BYTES if peek else None
+    for proto in ["https", "http"]:
+        url = f"{proto}://{domain}{path}"
+        try:
+            await asyncio.sleep(FETCH_DELAY + random.uniform(0, 0.5))
+            async with session.get(url, headers=headers, timeout=_TIMEOUT) as resp:
+                if resp.status == 429:
+                    FETCH_DELAY = FETCH_DELAY_BASE
+                    return None
+                if resp.status not in (200, 206) or not resp.headers.get("Content-Type", "").startswith("application/json"):
+                    return None
+                if limit is None:
+                    return await resp.read()
+                # Servers that ignore Range still only get read up to limit
+                body = bytearray()
+                async for chunk in resp.content.iter_chunked(limit):
+                    body.extend(chunk)
+                    if len(body) >= limit:
+                        break
+                return bytes(body)
+        except aiohttp.ClientConnectorError:
+            continue
+        except Exception:
+            return None
+    return None
+
 async def safe_test_rest_api(session: aiohttp.ClientSession, domain: str, idn_tokens: set[str]) -> bool:
     """Return True if domain exposes WP REST API AND site tokens match IDN tokens."""
-    global FETCH_DELAY  # declare early
-    api_paths = [
-        "/wp-json/wp/v2/types",
-        "/wp-json/wp/v2/posts?per_page=1",
-        "/wp-json/"
-    ]
-    for path in api_paths:
-        for proto in ["https", "http"]:
-            url = f"{proto}://{domain}{path}"
+    # The API index opens with the site name and its namespaces, so its first
+    # few KB settle almost every WordPress host in a single request
+    body = await fetch_rest(session, domain, "/wp-json/", peek=True)
+    if body and REST_NAMESPACES_RE.search(body):
+        site_name = ""
+        match = REST_NAME_RE.search(body)
+        if match:
             try:
-                await asyncio.sleep(FETCH_DELAY + random.uniform(0, 0.5))
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
-                    if resp.status == 429:
-                        FETCH_DELAY = FETCH_DELAY_BASE
-                        continue
-                    if resp.status == 200 and resp.headers.get("Content-Type", "").startswith("application/json"):
-                        text = await resp.text()
-                        if not text.strip().startswith(('{', '[')):
-                            continue
-                        try:
-                            data = json.loads(text)
-                            site_name = str(data.get("name") or "")
-                        except Exception:
-                            site_name = ""
+                site_name = str(json.loads(b'"' + match.group(1) + b'"'))
+            except Exception:
+                pass
+    else:
+        # Inconclusive (index blocked, moved or not JSON); try the types route
+        body = await fetch_rest(session, domain, "/wp-json/wp/v2/types")
+        if not body or not JSON_START_RE.match(body):
+            return False
+        site_name = ""
 
-                        site_tokens = tokenize(site_name) if site_name else tokenize(domain.split('.')[0])
+    site_tokens = tokenize(site_name) if site_name else tokenize(domain.split('.')[0])
 
-                        if idn_tokens & site_tokens:
-                            print(f"HIT REST API FOR {domain}")
-                            return True
-            except Exception:
-                continue
+    if not idn_tokens.isdisjoint(site_tokens):
+        print(f"HIT REST API FOR {domain}")
+        return True
     return False
 
-async def process_single_idn(session_search: aiohttp.ClientSession, 
-                            session_fetch: aiohttp.ClientSession, 
-                            name: str) -> bool:
+async def process_single_idn(session: aiohttp.ClientSession, name: str) -> bool:
     """Process a single IDN and return True if WordPress found."""
     
     try:
@@ -196,20 +234,24 @@ async def process_single_idn(session_search: aiohttp.ClientSession,
         idn_tokens = tokenize(name)
         
         # Search for domains
-        base_hosts = await safe_bing_search(session_search, name)
+        base_hosts = await safe_bing_search(session, name)
         if not base_hosts:
             return False
         
-        # Expand with common prefixes
+        # Expand with common prefixes. Hosts are canonicalised first, and only
+        # bare domains (example.org, not blog.example.org) get prefixed;
+        # repeats are dropped in first-seen order
         all_hosts = []
         for host in base_hosts:
+            host = host.lower().strip('.')
             all_hosts.append(host)
-            for prefix in WP_PREFIXES:
-                all_hosts.append(f"{prefix}{host}")
+            if host.count('.') == 1:
+                all_hosts.extend(f"{prefix}{host}" for prefix in WP_PREFIXES)
+        all_hosts = list(dict.fromkeys(all_hosts))
         
         # Test each host/path combination
         for host in all_hosts:
-            if await safe_test_rest_api(session_fetch, host, idn_tokens):
+            if await safe_test_rest_api(session, host, idn_tokens):
                 append_to_csv(name, host)
                 return True
         
@@ -240,10 +282,10 @@ async def main():
     print(f"📋 Loaded {len(names)} IDN names")
     
     # Get already processed names to avoid duplicates
-    processed_names = get_processed_names()
-    if processed_names:
-        print(f"📄 Found {len(processed_names)} already processed IDNs")
-        names = [name for name in names if name not in processed_names]
+    done = get_processed_names()
+    if done:
+        print(f"📄 Found {len(done)} already processed IDNs")
+        names = [name for name in names if name not in done]
         print(f"📋 Remaining to process: {len(names)} IDNs")
     
     if not names:
@@ -262,43 +304,51 @@ async def main():
     # Setup sessions
     ssl_context = ssl.create_default_context()
     connector = aiohttp.TCPConnector(
-        ssl=ssl_context, 
-        limit=10,
-        limit_per_host=2,
+        ssl=ssl_context,
+        limit=50,
+        limit_per_host=6,
         ttl_dns_cache=300,
-        use_dns_cache=True
+        use_dns_cache=True,
+        keepalive_timeout=60,
+        happy_eyeballs_delay=0.25,  # race IPv4 if IPv6 hasn't connected in 250ms
+        enable_cleanup_closed=True
     )
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
     found_count = 0
     
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as search_session, \
-               aiohttp.ClientSession(connector=connector, headers=headers) as fetch_session:
+    # A single session owns the connector; two sessions sharing it would
+    # each close it on exit
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
         
-        print("🔍 Starting sequential processing...")
+        print(f"🔍 Starting processing, {MAX_CONCURRENT} IDNs at a time...")
         
-        for i, name in enumerate(names, 1):
-            try:
-                found = await process_single_idn(search_session, fetch_session, name)
-                if found:
-                    found_count += 1
-                
-                # Progress update
-                if i % 25 == 0 or found:
-                    print(f"📊 Progress: {i}/{len(names)} processed, {found_count} WordPress sites found")
-                
-                # Small delay between IDNs
-                await asyncio.sleep(2)
-                
-            except KeyboardInterrupt:
-                print(f"\n⏹️  Stopped by user at {i}/{len(names)}")
-                break
-            except Exception as e:
-                print(f"❌ Unexpected error processing {name}: {e}")
-                await asyncio.sleep(5)
+        sem = asyncio.Semaphore(MAX_CONCURRENT)
+        processed = 0
+        
+        # append_to_csv never awaits, so concurrent IDNs can't interleave
+        # inside a write and no lock is needed around it
+        async def guarded(name: str) -> None:
+            nonlocal found_count, processed
+            async with sem:
+                try:
+                    found = await process_single_idn(session, name)
+                    if found:
+                        found_count += 1
+                    processed += 1
+                    
+                    # Progress update
+                    if processed % 25 == 0 or found:
+                        print(f"📊 Progress: {processed}/{len(names)} processed, {found_count} WordPress sites found")
+                    
+                    # Small delay before this slot takes the next IDN
+                    await asyncio.sleep(2)
+                    
+                except Exception as e:
+                    processed += 1
+                    print(f"❌ Unexpected error processing {name}: {e}")
+                    await asyncio.sleep(5)
+        
+        await asyncio.gather(*[guarded(name) for name in names])
     
     print(f"\n🎉 Completed! Found {found_count} WordPress sites")
     print(f"📁 Results saved in {OUTPUT_CSV}")
@@ -0,0 +1,81 @@
+"""
+SQLite-backed cache of Bing search results and WordPress probe outcomes.
+
+Lets a resumed or repeated crawl skip the Bing request entirely for names it
+has already searched, and skip re-probing URLs it has already tested, within
+the cache TTL. One SearchCache may be shared by several threads.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class SearchCache:
+    """Persistent map from a search query to the domains Bing returned for it,
+    and from a probed URL to whether it looked like WordPress."""
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        # Calls from any thread are serialised on one connection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL + NORMAL: one small write per probe shouldn't cost an fsync each
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            "query TEXT PRIMARY KEY, domains TEXT NOT NULL, ts INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "url TEXT PRIMARY KEY, wordpress INTEGER NOT NULL, ts INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, query):
+        """Return the cached domain list for query, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT domains FROM searches WHERE query = ? AND ts > ?",
+                (query, int(time.time()) - self.ttl),
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def put(self, query, domains):
+        """Store the domain list for query, replacing any older entry."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (query, domains, ts) VALUES (?, ?, ?)",
+                (query, json.dumps(domains), int(time.time())),
+            )
+            self._conn.commit()
+
+    def get_probe(self, url):
+        """Return the cached WordPress verdict for url, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT wordpress FROM probes WHERE url = ? AND ts > ?",
+                (url, int(time.time()) - self.ttl),
+            ).fetchone()
+            return bool(row[0]) if row else None
+
+    def put_probe(self, url, wordpress):
+        """Store the WordPress verdict for url, replacing any older entry."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probes (url, wordpress, ts) VALUES (?, ?, ?)",
+                (url, int(wordpress), int(time.time())),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -5,18 +5,30 @@ Writes results immediately to CSV as they are found.
 Can resume from interruptions.
 """
 
+import atexit
 import csv
+import functools
+import io
 import os
 import re
-import json
+import orjson
 import requests
+import threading
 import time
 import urllib.parse
-from bs4 import BeautifulSoup
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from patterns import JSON_START_RE, bing_result_links
+from search_cache import SearchCache
 
 # Configuration
 NAMES_CSV = "acuity_idns.csv"
 OUTPUT_CSV = "wordpress_api_idns.csv"
+SEARCH_CACHE_DB = "search_cache.db"
+SEARCH_CACHE_TTL = 7 * 86400  # Search results are reused for a week
 SEARCH_DELAY_BASE = 12.0   # original delay
 FETCH_DELAY_BASE  = 4.0
 
@@ -24,12 +36,66 @@ FETCH_DELAY_BASE  = 4.0
 SEARCH_DELAY = SEARCH_DELAY_BASE / 2
 FETCH_DELAY  = FETCH_DELAY_BASE  / 2
 
-# When we see rate-limit (HTTP 429) responses we'll revert to the base delays
+# When Bing rate-limits (HTTP 429) we revert to the base search delay; a
+# target host that does gets its own spacing doubled (see slow_down_host)
 
 TIMEOUT = 30         # Request timeout
 MAX_RESULTS = 3      # Number of search results to check per IDN
+SEARCH_CHUNK = 16384 # Bytes of the Bing page read per step
+SEARCH_WORKERS = 4   # Threads running Bing searches (they queue for Bing's slot)
+MAX_WORKERS = 16     # Threads probing search results, one IDN each
+MAX_PER_HOST = 1     # Concurrent requests allowed to any one target host
+SYNC_EVERY = 10      # Found sites written between syncs of the CSV to disk
+REST_PEEK_BYTES = 8192  # Bytes of /wp-json/ read; name and namespaces come first
+
+BING_HOST = "www.bing.com"
+
+# Fallback for an index cut off at REST_PEEK_BYTES, which won't parse whole
+REST_NAMESPACES_RE = re.compile(rb'"namespaces"\s*:\s*\[')
+REST_NAME_RE = re.compile(rb'"name"\s*:\s*"((?:[^"\\]|\\.)*)"')
+MAX_HOST_INTERVAL = 60.0  # Ceiling for a host's spacing after repeated 429s
+
+# Shared between worker threads (and concurrent main() calls): requests to
+# any one host (Bing included) are spaced out across all threads, see
+# wait_for_host(). Requests to different hosts never wait on each other.
+_host_lock = threading.Lock()
+_host_next = defaultdict(float)   # host -> earliest monotonic time of its next request
+_host_interval = {}               # host -> spacing, once a 429 has raised it
+
+# Two IDNs often resolve to the same site; this keeps the pool from
+# hitting one host with several requests at once
+_host_semaphores = defaultdict(lambda: threading.Semaphore(MAX_PER_HOST))
+_host_semaphores_lock = threading.Lock()
 
-# WordPress detection patterns
+_datasync = getattr(os, "fdatasync", os.fsync)  # no fdatasync on macOS
+
+# Directory and listing sites come back for many different IDNs; each
+# domain's REST index is fetched once per run. Maps domain -> site name
+# ("" if unnamed), or None when it has no WordPress REST API.
+_DOMAIN_CACHE: dict[str, str | None] = {}
+_domain_cache_lock = threading.Lock()
+
+# One pooled session for Bing and every probed host, so repeat requests to a
+# host reuse its keep-alive connection. Transient 5xx errors are retried with
+# backoff; 429 is left to the callers, which slow the crawl down themselves.
+# Connect and read errors are not retried: a dead host fails fast, and
+# test_rest_api's http fallback is its only second attempt.
+SESSION = requests.Session()
+SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+})
+_adapter = HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, connect=0, read=0, backoff_factor=0.5,
+                      status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# WordPress detection patterns for HTML bodies (detection here goes through
+# the REST API, so these are not on the probe path). All fixed literals: the
+# generator meta tag and "powered by" footer are already caught by WordPress.
 WP_PATTERNS = [
     r'/wp-content/',
     r'/wp-includes/',
@@ -37,9 +103,7 @@ WP_PATTERNS = [
     r'wp-json',
     r'WordPress',
     r'wp-embed',
-    r'wp_enqueue_script',
-    r'generator.*wordpress',
-    r'powered by wordpress'
+    r'wp_enqueue_script'
 ]
 WP_REGEX = re.compile('|'.join(WP_PATTERNS), re.IGNORECASE)
 
@@ -53,33 +117,91 @@ STOP_WORDS = {
     'medical', 'healthcare', 'health', 'hospital', 'hospitals', 'clinic', 'clinics', 'care'
 }
 
-def tokenize(text: str) -> set[str]:
-    """Return a set of lowercase tokens excluding stop-words and punctuation."""
+_NON_ALPHA = re.compile(r"[^a-zA-Z]")
+
+@functools.lru_cache(maxsize=4096)
+def tokenize(text: str) -> frozenset[str]:
+    """Return a set of lowercase tokens excluding stop-words and punctuation.
+
+    Memoised: the same site names and domain labels come up again and again
+    across IDNs. The result is frozen so the cached value can't be mutated.
+    """
     # Replace non-alpha with space, split, filter
-    tokens = re.sub(r"[^a-zA-Z]", " ", text).lower().split()
-    return {tok for tok in tokens if tok and tok not in STOP_WORDS}
+    tokens = _NON_ALPHA.sub(" ", text).lower().split()
+    return frozenset(tok for tok in tokens if tok and tok not in STOP_WORDS)
 
 def log_message(msg):
     """Print timestamped log message"""
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {msg}", flush=True)
 
-def write_wordpress_site(name, domain):
-    """Immediately write a WordPress site to CSV"""
+def wait_for_host(host, interval=None):
+    """Block until this thread's turn to request host comes up.
+
+    Turns are handed out FETCH_DELAY apart (or interval, or the host's
+    backed-off spacing); the slot is reserved under the lock and slept for
+    outside it, so other hosts are never held up.
+    """
+    with _host_lock:
+        if interval is None:
+            interval = _host_interval.get(host, FETCH_DELAY)
+        now = time.monotonic()
+        start = max(now, _host_next[host])
+        _host_next[host] = start + interval
+    time.sleep(start - now)
+
+def slow_down_host(host):
+    """Double host's request spacing after it answered 429"""
+    with _host_lock:
+        interval = _host_interval.get(host, FETCH_DELAY)
+        _host_interval[host] = min(interval * 2, MAX_HOST_INTERVAL)
+
+def host_semaphore(host):
+    """Return the semaphore limiting concurrent requests to host"""
+    # Locked so two threads can't each create a semaphore for a new host
+    with _host_semaphores_lock:
+        return _host_semaphores[host]
+
+class ResultsFile:
+    """Append-only results CSV, written by one main() run's probe threads.
+
+    Each row goes to the OS in one os.write as soon as it's found, so a crash
+    can't lose it; only the disk sync is batched, every SYNC_EVERY rows. Rows
+    are still quoted by csv, so the file format is unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+        self._writes = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, name, domain):
+        """Append one row and hand it to the OS straight away."""
+        with self._lock:
+            self._buf.seek(0)
+            self._buf.truncate()
+            self._writer.writerow([name, domain])
+            os.write(self._fd, self._buf.getvalue().encode('utf-8'))
+            self._writes += 1
+            if self._writes % SYNC_EVERY == 0:
+                _datasync(self._fd)
+
+    def close(self):
+        """Sync the file to disk and close it; a no-op once closed."""
+        with self._lock:
+            if self._fd is None:
+                return
+            _datasync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+def write_wordpress_site(results, name, domain):
+    """Immediately write a WordPress site to the results CSV"""
     try:
-        # Check if file exists to determine if we need headers
-        file_exists = os.path.exists(OUTPUT_CSV)
-        
-        with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            
-            # Write headers if file is new
-            if not file_exists:
-                writer.writerow(['name', 'domain'])
-            
-            # Write the WordPress site
-            writer.writerow([name, domain])
-            f.flush()  # Force write to disk
+        results.write(name, domain)
         
         log_message(f"✓ WordPress found: {name} -> {domain}")
         return True
@@ -87,12 +209,12 @@ def write_wordpress_site(name, domain):
         log_message(f"Error writing to CSV: {e}")
         return False
 
-def get_processed_names():
+def get_processed_names(output_csv):
     """Get list of already processed names from CSV"""
     processed = set()
     try:
-        if os.path.exists(OUTPUT_CSV):
-            with open(OUTPUT_CSV, 'r', encoding='utf-8') as f:
+        if os.path.exists(output_csv):
+            with open(output_csv, 'r', encoding='utf-8') as f:
                 reader = csv.reader(f)
                 next(reader, None)  # Skip header
                 for row in reader:
@@ -102,110 +224,172 @@ def get_processed_names():
         log_message(f"Error reading existing results: {e}")
     return processed
 
+def result_domains(body):
+    """Return up to MAX_RESULTS domains from the (possibly partial) Bing page body"""
+    domains = []
+    for href in bing_result_links(body):
+        try:
+            parsed = urllib.parse.urlparse(href)
+            if parsed.netloc:
+                domains.append(parsed.netloc)
+                if len(domains) >= MAX_RESULTS:
+                    break
+        except:
+            continue
+    return domains
+
 def search_bing(query):
-    """Search Bing and return domain list"""
+    """Search Bing and return domain list, or None if the search failed"""
+    global SEARCH_DELAY
     try:
-        search_url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
+        search_url = f"https://{BING_HOST}/search?q={urllib.parse.quote(query)}"
+        wait_for_host(BING_HOST, SEARCH_DELAY)
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(search_url, headers=headers, timeout=TIMEOUT)
+        # Streamed: the page is read only until MAX_RESULTS results have
+        # arrived, instead of downloading the whole results page every time
+        with SESSION.get(search_url, timeout=TIMEOUT, stream=True) as response:
 
-        # Handle Bing rate-limit
-        global SEARCH_DELAY
-        if response.status_code == 429:
-            SEARCH_DELAY = SEARCH_DELAY_BASE  # revert
-            log_message("Bing returned 429 – increasing delay")
-            return []
+            # Handle Bing rate-limit
+            if response.status_code == 429:
+                SEARCH_DELAY = SEARCH_DELAY_BASE  # revert
+                log_message("Bing returned 429 – increasing delay")
+                return None
 
-        if response.status_code != 200:
-            return []
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        domains = []
-        for link in soup.select("h2 a, .b_algo h2 a"):
-            href = link.get("href")
-            if href and isinstance(href, str) and href.startswith("http"):
-                try:
-                    parsed = urllib.parse.urlparse(href)
-                    if parsed.netloc:
-                        domains.append(parsed.netloc)
-                        if len(domains) >= MAX_RESULTS:
-                            break
-                except:
-                    continue
+            if response.status_code != 200:
+                return None
+            
+            body = bytearray()
+            domains = []
+            for chunk in response.iter_content(SEARCH_CHUNK):
+                body.extend(chunk)
+                domains = result_domains(body)
+                if len(domains) >= MAX_RESULTS:
+                    break
         
         return domains
         
     except Exception as e:
         log_message(f"Bing search error for '{query}': {e}")
-        return []
+        return None
 
-def test_rest_api(domain: str, idn_tokens: set[str]) -> bool:
-    """Return True if the domain exposes a WordPress REST API AND its site name matches the IDN tokens."""
-    API_PATHS = [
-        "/wp-json/wp/v2/types",
-        "/wp-json/wp/v2/posts?per_page=1",
-        "/wp-json/"
-    ]
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    }
-    for path in API_PATHS:
-        for proto in ("https", "http"):
-            url = f"{proto}://{domain}{path}"
-            try:
-                resp = requests.get(url, headers=headers, timeout=TIMEOUT, verify=False)
-                if resp.status_code == 429:
-                    global FETCH_DELAY
-                    FETCH_DELAY = FETCH_DELAY_BASE
-                    log_message(f"Rate limited (429) for {url} – increasing fetch delay")
-                    return False
-                if resp.status_code == 200 and resp.headers.get("content-type", "").startswith("application/json"):
-                    txt = resp.text.strip()
-                    if not (txt.startswith("{") or txt.startswith("[")):
-                        continue
-                    try:
-                        data = json.loads(txt)
-                        site_name = str(data.get("name") or "")
-                    except Exception:
-                        site_name = ""
+def index_site_name(body: bytes) -> str | None:
+    """Site name from the head of a /wp-json/ index, or None if it isn't one"""
+    if not JSON_START_RE.match(body):
+        return None
+    try:
+        data = orjson.loads(body)
+    except ValueError:
+        # Truncated mid-document; pick the two fields out of the raw bytes
+        if not REST_NAMESPACES_RE.search(body):
+            return None
+        match = REST_NAME_RE.search(body)
+        try:
+            return str(orjson.loads(b'"' + match.group(1) + b'"')) if match else ""
+        except ValueError:
+            return ""
+    if not isinstance(data, dict) or "namespaces" not in data:
+        return None
+    return str(data.get("name") or "")
 
-                    site_tokens = tokenize(site_name) if site_name else tokenize(domain.split(".")[0])
+def fetch_site_name(domain: str) -> tuple[str | None, bool]:
+    """Fetch the domain's REST index; return (site name or None, whether that answer is final).
 
-                    if idn_tokens & site_tokens:
-                        log_message(f"HIT REST API FOR {domain}")
-                        return True
-            except Exception:
-                continue
+    Rate limits, failed requests and unreachable hosts are not final, so they
+    are never cached and the domain is tried again for the next IDN.
+    """
+    # /wp-json/ alone identifies the REST API; http is only tried when https
+    # can't be reached at all, not when it merely answers with an error
+    for proto in ("https", "http"):
+        url = f"{proto}://{domain}/wp-json/"
+        try:
+            wait_for_host(domain)
+            with host_semaphore(domain):
+                resp = SESSION.get(url, timeout=TIMEOUT, verify=False, allow_redirects=True, stream=True)
+                with resp:
+                    if resp.status_code == 429:
+                        slow_down_host(domain)
+                        log_message(f"Rate limited (429) for {url} – backing off {domain}")
+                        return None, False
+                    # Decided on the headers alone, before any body is read:
+                    # a non-JSON /wp-json/ costs no more than a HEAD would,
+                    # and a real index doesn't pay for a second round trip
+                    if resp.status_code != 200 or not resp.headers.get("content-type", "").startswith("application/json"):
+                        return None, True
+                    # The routes map after namespaces is what makes the index
+                    # 100 KB+; it is never downloaded
+                    body = resp.raw.read(REST_PEEK_BYTES, decode_content=True)
+        except requests.exceptions.ConnectionError:  # includes SSLError
+            continue
+        except Exception:
+            return None, False
+
+        return index_site_name(body), True
+    return None, False
+
+def test_rest_api(domain: str, idn_tokens: frozenset[str], use_relevancy: bool = True) -> bool:
+    """Return True if the domain exposes a WordPress REST API AND (with use_relevancy) its site name matches the IDN tokens."""
+    with _domain_cache_lock:
+        cached = domain in _DOMAIN_CACHE
+        site_name = _DOMAIN_CACHE.get(domain)
+    if not cached:
+        site_name, final = fetch_site_name(domain)
+        if final:
+            with _domain_cache_lock:
+                _DOMAIN_CACHE[domain] = site_name
+
+    # The relevancy check depends on the IDN, so it runs on every call
+    if site_name is None:
+        return False
+    if not use_relevancy:
+        log_message(f"HIT REST API FOR {domain}")
+        return True
+    site_tokens = tokenize(site_name) if site_name else tokenize(domain.split(".")[0])
+
+    # isdisjoint stops at the first shared token and builds no result set
+    if not idn_tokens.isdisjoint(site_tokens):
+        log_message(f"HIT REST API FOR {domain}")
+        return True
     return False
 
-def process_idn(name, processed_count, total_count):
-    """Process a single IDN and return True if WordPress found"""
+def search_idn(cache, name, processed_count, total_count):
+    """First pipeline stage: search Bing for an IDN and return its domains"""
     try:
         log_message(f"Processing {processed_count}/{total_count}: {name}")
         
-        # Pre-compute token set for relevancy check
-        idn_tokens = tokenize(name)
-        
-        # Search for the IDN
-        domains = search_bing(name)
-        time.sleep(SEARCH_DELAY)
+        # Search for the IDN (search_bing waits for its turn with Bing),
+        # unless a recent run already did; failed searches aren't cached
+        domains = cache.get(name)
+        if domains is None:
+            domains = search_bing(name)
+            if domains is not None:
+                cache.put(name, domains)
         
         if not domains:
             log_message(f"No domains found for: {name}")
-            return False
+        return domains or []
+        
+    except Exception as e:
+        log_message(f"Error searching {name}: {e}")
+        return []
+
+def probe_idn(results, name, domains, use_relevancy):
+    """Second pipeline stage: return True if one of the IDN's domains is WordPress"""
+    try:
+        # Pre-compute token set for relevancy check
+        idn_tokens = tokenize(name)
         
-        # Test each domain for WordPress
-        for domain in domains:
+        # Test each domain for WordPress; www.example.org and example.org are
+        # the same site, so only the first of them is tested. It is tested
+        # under the name Bing returned, since the other one may not resolve
+        # or have a valid certificate. Lowercased, so the cache sees one name.
+        hosts = {}
+        for d in domains:
+            hosts.setdefault(d.lower().removeprefix("www."), d.lower())
+        for domain in hosts.values():
             try:
-                if test_rest_api(domain, idn_tokens):
-                    write_wordpress_site(name, domain)
+                if test_rest_api(domain, idn_tokens, use_relevancy):
+                    write_wordpress_site(results, name, domain)
                     return True
-                time.sleep(FETCH_DELAY)
             except Exception:
                 continue
         
@@ -215,8 +399,16 @@ def process_idn(name, processed_count, total_count):
         log_message(f"Error processing {name}: {e}")
         return False
 
-def main():
-    """Main crawler function"""
+def main(names_csv=NAMES_CSV, output_csv=OUTPUT_CSV, use_relevancy=True):
+    """Main crawler function.
+
+    Defaults to this crawler's usual files; another caller (e.g.
+    start_crawlers) can point a run at other files or, with
+    use_relevancy=False, accept any WordPress REST API hit. The settings
+    are passed down rather than stored in the module, so runs with
+    different ones can share a process, even at the same time (use a
+    distinct output_csv for each).
+    """
     log_message("Starting simple WordPress detection crawler...")
     
     # Disable SSL warnings
@@ -225,7 +417,7 @@ def main():
     
     # Load IDN names
     try:
-        with open(NAMES_CSV, 'r', encoding='utf-8') as f:
+        with open(names_csv, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             names = []
             for i, row in enumerate(reader):
@@ -246,48 +438,78 @@ def main():
         return
     
     # Get already processed names to avoid duplicates
-    processed_names = get_processed_names()
+    processed_names = get_processed_names(output_csv)
     if processed_names:
         log_message(f"Found {len(processed_names)} already processed IDNs")
         names = [name for name in names if name not in processed_names]
         log_message(f"Remaining to process: {len(names)} IDNs")
     
     # Initialize CSV file if it doesn't exist
-    if not os.path.exists(OUTPUT_CSV):
+    if not os.path.exists(output_csv):
         try:
-            with open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f:
+            with open(output_csv, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
                 writer.writerow(['name', 'domain'])
-            log_message(f"Initialized output file: {OUTPUT_CSV}")
+            log_message(f"Initialized output file: {output_csv}")
         except Exception as e:
             log_message(f"Error initializing CSV: {e}")
             return
     
+    # Header is in place; hits are appended through one descriptor, which
+    # is synced and closed when this run ends (or, failing that, at exit)
+    results = ResultsFile(output_csv)
+    atexit.register(results.close)
+    
+    cache = SearchCache(SEARCH_CACHE_DB, SEARCH_CACHE_TTL)
+    atexit.register(cache.close)
+    
     wordpress_found = 0
     start_time = time.time()
     
-    for i, name in enumerate(names, 1):
-        try:
-            found = process_idn(name, i, len(names))
-            if found:
-                wordpress_found += 1
-            
-            # Progress update every 25 IDNs
-            if i % 25 == 0:
-                elapsed = time.time() - start_time
-                rate = i / elapsed * 60  # IDNs per minute
-                log_message(f"Progress: {i}/{len(names)} processed, {wordpress_found} WordPress sites found, {elapsed:.1f}s elapsed, rate: {rate:.1f}/min")
-            
-        except KeyboardInterrupt:
-            log_message("Crawler interrupted by user")
-            break
-        except Exception as e:
-            log_message(f"Error with IDN {i} ({name}): {e}")
-            continue
+    # Two stages: searches run in their own pool and each one's domains are
+    # handed to the probe pool, so the next Bing searches go out while
+    # earlier IDNs are still being probed
+    search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+    probe_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    done = 0
+    try:
+        searches = {search_pool.submit(search_idn, cache, name, i, len(names)): name
+                    for i, name in enumerate(names, 1)}
+        pending = set(searches)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    if future in searches:
+                        domains = future.result()
+                        if domains:
+                            pending.add(probe_pool.submit(probe_idn, results, searches[future], domains, use_relevancy))
+                            continue
+                    elif future.result():
+                        wordpress_found += 1
+                except Exception as e:
+                    log_message(f"Error processing IDN: {e}")
+                done += 1
+                
+                # Progress update every 25 IDNs
+                if done % 25 == 0:
+                    elapsed = time.time() - start_time
+                    rate = done / elapsed * 60  # IDNs per minute
+                    log_message(f"Progress: {done}/{len(names)} processed, {wordpress_found} WordPress sites found, {elapsed:.1f}s elapsed, rate: {rate:.1f}/min")
+    except KeyboardInterrupt:
+        log_message("Crawler interrupted by user – finishing in-flight IDNs")
+        # Still an interrupt to the caller (e.g. start_crawlers' sequential
+        # mode), which must stop rather than move on to the next crawler
+        raise
+    finally:
+        search_pool.shutdown(wait=True, cancel_futures=True)
+        probe_pool.shutdown(wait=True, cancel_futures=True)
+        results.close()
+        cache.close()
     
     elapsed = time.time() - start_time
     log_message(f"Crawler completed! Found {wordpress_found} WordPress sites in {elapsed:.1f}s")
-    log_message(f"Results saved to: {OUTPUT_CSV}")
+    log_message(f"Results saved to: {output_csv}")
 
 if __name__ == "__main__":
     try:
@@ -41,14 +41,11 @@ def run_simple_crawler():
     """Run the simple crawler with proper logging"""
     logger.info("Starting simple crawler...")
     try:
-        result = subprocess.run([
-            sys.executable, 'simple_wp_crawler.py'
-        ], capture_output=False, text=True, timeout=None)
-        
-        if result.returncode == 0:
-            logger.info("Simple crawler completed successfully")
-        else:
-            logger.error(f"Simple crawler failed with return code: {result.returncode}")
+        # Run in this interpreter rather than a child one; imported here so
+        # each mode only loads the crawler (and dependencies) it needs
+        import simple_wp_crawler
+        simple_wp_crawler.main()
+        logger.info("Simple crawler completed successfully")
             
     except Exception as e:
         logger.error(f"Error running simple crawler: {e}")
@@ -56,18 +53,29 @@ def run_simple_crawler():
 def run_robust_crawler():
     """Run the robust crawler with proper logging"""
     logger.info("Starting robust crawler...")
+    try:
+        import robust_wp_crawler
+        asyncio.run(robust_wp_crawler.main())
+        logger.info("Robust crawler completed successfully")
+            
+    except Exception as e:
+        logger.error(f"Error running robust crawler: {e}")
+
+def run_crawler_process(script, label):
+    """Run a crawler script in a child interpreter with proper logging"""
+    logger.info(f"Starting {label} crawler process...")
     try:
         result = subprocess.run([
-            sys.executable, 'robust_wp_crawler.py'
+            sys.executable, script
         ], capture_output=False, text=True, timeout=None)
         
         if result.returncode == 0:
-            logger.info("Robust crawler completed successfully")
+            logger.info(f"{label.capitalize()} crawler completed successfully")
         else:
-            logger.error(f"Robust crawler failed with return code: {result.returncode}")
+            logger.error(f"{label.capitalize()} crawler failed with return code: {result.returncode}")
             
     except Exception as e:
-        logger.error(f"Error running robust crawler: {e}")
+        logger.error(f"Error running {label} crawler: {e}")
 
 def run_sequential():
     """Run crawlers one after another"""
@@ -90,10 +98,13 @@ def run_parallel():
     
     import concurrent.futures
     
+    # Child processes here, not in-process threads: Ctrl-C reaches both
+    # children and stops them, where a crawler thread would keep the
+    # executor (and so this script) waiting for its crawl to finish
     with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
         # Submit both crawlers
-        simple_future = executor.submit(run_simple_crawler)
-        robust_future = executor.submit(run_robust_crawler)
+        simple_future = executor.submit(run_crawler_process, 'simple_wp_crawler.py', 'simple')
+        robust_future = executor.submit(run_crawler_process, 'robust_wp_crawler.py', 'robust')
         
         # Wait for both to complete
         concurrent.futures.wait([simple_future, robust_future])